@@ -1,16 +1,167 @@
 # Import Python libraries #
-from bs4 import BeautifulSoup
+## Heavy libraries (bs4, matplotlib, talib, yahooquery) are imported by the functions using them ##
+import argparse
+import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, redirect_stdout
 import datetime as dt
+import functools
 import gc
-import matplotlib.pyplot as plt
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import itertools
+import json
+import logging
+from multiprocessing import shared_memory
 import numpy as np
 import os
 import pandas as pd
+import platform
+import queue
 from random import choice
 import re
 import requests
-import talib as ta
-from yahooquery import Ticker
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+
+######################################################################################################################################
+''' 
+##########          ########## 
+        INSTRUMENTATION 
+##########          ##########  
+'''
+
+class Metrics(object):
+    '''
+    Lightweight run metrics - wall time per stage, counters (requests, retries, 
+    bytes downloaded, rows written) and per-ticker failures. Every event is also
+    written as a JSON log line and the totals can be exported in Prometheus 
+    text format.
+    Parameter:
+        prefix        : Prefix of Prometheus metric names. Default value is sgx
+    '''
+    
+    def __init__(self, prefix='sgx'):
+        self.prefix = prefix
+        self.logger = logging.getLogger('TA_SGX')
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        '''
+        Clear all recorded metrics.
+        '''
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+            self.failures = []
+    
+    def log(self, event, **fields):
+        '''
+        Write one structured log line.
+        '''
+        fields = dict(event=event, time=dt.datetime.now().isoformat(), **fields)
+        self.logger.info(json.dumps(fields, default=str))
+    
+    @contextmanager
+    def stage(self, name):
+        '''
+        Time a stage of the pipeline, e.g. with metrics.stage('get_historical'): ...
+        '''
+        self.log('stage_start', stage=name)
+        start_time = time.time()
+        status = 'ok'
+        try:
+            yield self
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            seconds = time.time() - start_time
+            with self.lock:
+                stat = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'errors': 0})
+                stat['calls'] += 1
+                stat['seconds'] += seconds
+                stat['errors'] += status == 'error'
+            self.log('stage_end', stage=name, seconds=round(seconds, 6), status=status)
+    
+    def increment(self, name, value=1, stage=None):
+        '''
+        Add to a counter, e.g. requests, retries, bytes_downloaded or rows_written.
+        '''
+        with self.lock:
+            self.counters[(name, stage)] = self.counters.get((name, stage), 0) + value
+    
+    def failure(self, stage, ticker, error=None):
+        '''
+        Record a ticker that failed in a stage.
+        '''
+        with self.lock:
+            self.failures.append({'stage': stage, 'ticker': ticker, 'error': str(error)})
+            self.counters[('failures', stage)] = self.counters.get(('failures', stage), 0) + 1
+        self.log('failure', stage=stage, ticker=ticker, error=str(error))
+    
+    def summary(self):
+        '''
+        Return a DataFrame of wall time, calls and counters per stage.
+        '''
+        with self.lock:
+            summary = pd.DataFrame.from_dict(self.stages, orient='index')
+            for (name, stage), value in self.counters.items():
+                summary.loc[stage, name] = value
+        summary.index.name = 'STAGE'
+        
+        return summary
+    
+    def write_prometheus(self, path):
+        '''
+        Write all metrics to a file in Prometheus text exposition format.
+        Parameter:
+            path          : Filename (incl path), e.g. for node_exporter's textfile collector
+        '''
+        lines = []
+        with self.lock:
+            ## Stage timings ##
+            for metric, key, kind in [('stage_seconds_total', 'seconds', 'counter'), 
+                                      ('stage_calls_total', 'calls', 'counter'),
+                                      ('stage_errors_total', 'errors', 'counter')]:
+                lines.append('# TYPE %s_%s %s' % (self.prefix, metric, kind))
+                for name, stat in sorted(self.stages.items()):
+                    lines.append('%s_%s{stage="%s"} %s' % (self.prefix, metric, name, stat[key]))
+            ## Counters ##
+            for name in sorted(set(name for name, stage in self.counters)):
+                lines.append('# TYPE %s_%s_total counter' % (self.prefix, name))
+                for (counter, stage), value in sorted(self.counters.items(), key=str):
+                    if counter == name:
+                        lines.append('%s_%s_total{stage="%s"} %s' % (self.prefix, name, stage or '', value))
+        
+        # Write atomically so collectors never read a partial file #
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def instrument(stage):
+    '''
+    Decorator timing every call of a function as a stage of the shared metrics.
+    Parameter:
+        stage         : Name of the stage
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    
+    return decorator
 
 ######################################################################################################################################
 ''' 
@@ -19,35 +170,209 @@ from yahooquery import Ticker
 ##########          ##########  
 '''
 
-def get_proxy():
+def get_proxy(proxy_url='https://www.sslproxies.org/'):
     '''
     Generate working proxy address
+    Parameter:
+        proxy_url   : Website listing free proxies. Default value is sslproxies.org
     Return:
         proxy       : Working proxy address and port  
     '''
-    # Initiate parameter #
-    proxy_url = 'https://www.sslproxies.org/'
+    # Randomise to return one proxy address #
+    proxy = {'https': choice(get_proxy_list(proxy_url))}
+    
+    return proxy 
+
+
+def get_proxy_list(proxy_url='https://www.sslproxies.org/'):
+    '''
+    Scrape all proxy addresses listed on the proxy website.
+    Parameter:
+        proxy_url   : Website listing free proxies. Default value is sslproxies.org
+    Return:
+        proxies     : List of proxy addresses and ports
+    '''
+    from bs4 import BeautifulSoup
     
     # Send GET request and scrape all proxy addresses #
-    response = requests.get(proxy_url)
+    response = requests.get(proxy_url, timeout=10)
     soup = BeautifulSoup(response.content, 'html5lib')
     rows = soup.find('tbody').find_all('tr')
     proxies = [(row.find('td').text.strip() + ':' + 
                row.find('td').find_next('td').text.strip())
                for row in rows]
     
-    # Randomise to return one proxy address #
-    proxy = {'https': choice(proxies)}
+    # Free up memory #
+    clean_responses(response, soup)
     
-    return proxy 
+    return proxies
+
+
+class ProxyPool(object):
+    '''
+    Pool of proxy addresses that is scraped once per TTL instead of once per request.
+    Each proxy keeps a pooled requests.Session and its latency and success counts;
+    requests go to the healthiest, fastest proxies first and proxies that fail
+    repeatedly are evicted until the TTL expires.
+    Parameters:
+        proxy_url     : Website listing free proxies. Default value is sslproxies.org
+        ttl           : Seconds before the proxy list is scraped again and evicted proxies
+                        may return. Default value is 600
+        max_failures  : Consecutive failures before a proxy is evicted. Default value is 3
+        timeout       : Request timeout in seconds. Default value is 5
+        backoff       : Seconds before an empty pool is scraped again, doubled on each
+                        retry of a request. Default value is 5
+    '''
+    
+    def __init__(self, proxy_url='https://www.sslproxies.org/', ttl=600, max_failures=3, timeout=5,
+                 backoff=5):
+        self.proxy_url = proxy_url
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self.timeout = timeout
+        self.backoff = backoff
+        self.stats = {}
+        self.sessions = {}
+        self.evicted = {}
+        self.refreshed = None
+        self.lock = threading.Lock()
+    
+    def refresh(self, force=False):
+        '''
+        Scrape the proxy list again if the TTL has expired, or if no proxy is left
+        and the last scrape is older than the backoff.
+        '''
+        with self.lock:
+            now = time.time()
+            if not force and self.refreshed is not None and \
+               now - self.refreshed < (self.ttl if self.stats else self.backoff):
+                return
+            ## Evictions expire with the TTL ##
+            self.evicted = {proxy: evicted for proxy, evicted in self.evicted.items() 
+                            if now - evicted < self.ttl}
+            self.refreshed = now
+            for proxy in get_proxy_list(self.proxy_url):
+                if proxy not in self.stats and proxy not in self.evicted:
+                    self.stats[proxy] = {'success': 0, 'failure': 0, 'consecutive': 0, 'latency': None}
+    
+    def pick(self):
+        '''
+        Return the best proxy - highest smoothed success rate, then lowest latency.
+        '''
+        self.refresh()
+        with self.lock:
+            if not self.stats:
+                raise requests.exceptions.ProxyError('No proxy available from %s' % self.proxy_url)
+            def score(proxy):
+                stat = self.stats[proxy]
+                success_rate = (stat['success'] + 1.0)/(stat['success'] + stat['failure'] + 2.0)
+                latency = self.timeout if stat['latency'] is None else stat['latency']
+                return (-success_rate, latency)
+            return min(self.stats, key=score)
+    
+    def get_session(self, proxy):
+        '''
+        Return the pooled session routed through the proxy.
+        '''
+        with self.lock:
+            if proxy not in self.sessions:
+                session = requests.Session()
+                session.proxies = {'http': 'http://' + proxy, 'https': 'http://' + proxy}
+                self.sessions[proxy] = session
+            return self.sessions[proxy]
+    
+    def report(self, proxy, success, latency=None):
+        '''
+        Record the outcome of a request and evict the proxy after repeated failures.
+        '''
+        with self.lock:
+            stat = self.stats.get(proxy)
+            if stat is None:
+                return
+            if success:
+                stat['success'] += 1
+                stat['consecutive'] = 0
+                ## Exponentially weighted latency ##
+                stat['latency'] = latency if stat['latency'] is None else \
+                                  0.7*stat['latency'] + 0.3*latency
+            else:
+                stat['failure'] += 1
+                stat['consecutive'] += 1
+                if stat['consecutive'] >= self.max_failures:
+                    self.evict(proxy)
+    
+    def evict(self, proxy):
+        '''
+        Drop the proxy until the TTL expires and close its session. Caller must hold the lock.
+        '''
+        self.stats.pop(proxy, None)
+        self.evicted[proxy] = time.time()
+        session = self.sessions.pop(proxy, None)
+        if session is not None:
+            session.close()
+    
+    def request(self, request_type, target_url, max_retries=10, **kwargs):
+        '''
+        Send request through the pool, switching proxy on failure. When no proxy is 
+        available the attempt waits with exponential backoff before the next one.
+        Connection errors, timeouts, proxy authentication (407) and gateway (5xx) 
+        errors count against the proxy; other error responses of the target, e.g. 
+        404, are returned to the caller.
+        Parameters:
+            request_type  : Type of request
+            target_url    : Target website
+            max_retries   : Maximum number of attempts. Default value is 10
+        Return:
+            response      : Response from the target website
+        '''
+        kwargs.setdefault('timeout', self.timeout)
+        error = None
+        for attempt in range(max_retries):
+            if attempt:
+                metrics.increment('retries', stage='proxy_request')
+            proxy = None
+            try:
+                proxy = self.pick()
+                start_time = time.time()
+                metrics.increment('requests', stage='proxy_request')
+                response = self.get_session(proxy).request(request_type, target_url, **kwargs)
+                if response.status_code == 407 or response.status_code >= 500:
+                    response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                error = e
+                if proxy is not None:
+                    self.report(proxy, False)
+                elif attempt < max_retries - 1:
+                    time.sleep(min(self.backoff * 2**attempt, self.ttl))
+            else:
+                self.report(proxy, True, time.time() - start_time)
+                metrics.increment('bytes_downloaded', len(response.content), stage='proxy_request')
+                return response
+        
+        raise requests.exceptions.RetryError('%s failed after %d attempts: %s' % 
+                                             (target_url, max_retries, error))
 
 
-def proxy_request(request_type, target_url, **kwargs):
+def get_proxy_pool():
+    '''
+    Return the shared ProxyPool, creating it on first use.
+    '''
+    global proxy_pool
+    if proxy_pool is None:
+        proxy_pool = ProxyPool()
+    
+    return proxy_pool
+
+
+@instrument('proxy_request')
+def proxy_request(request_type, target_url, max_retries=10, pool=None, **kwargs):
     '''
     Send GET request to target website using proxy address
     Parameters:
         request_type  : Type of request
         target_url    : Target website
+        max_retries   : Maximum number of attempts. Default value is 10
+        pool          : ProxyPool to use. Default value is the shared pool
     '''
     # Initiate parameter #
     headers = ['Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:47.0) Gecko/20100101 Firefox/47.0',
@@ -60,22 +385,265 @@ def proxy_request(request_type, target_url, **kwargs):
                '(KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36'),
                'Mozilla/5.0 (compatible; MSIE 9.0; Windows Phone OS 7.5; Trident/5.0; IEMobile/9.0)']
     header = {'User-Agent': choice(headers)}
+    if pool is None:
+        pool = get_proxy_pool()
     
-    while True:
-        try:
-            # Generate one proxy address #
-            proxy = get_proxy()
-            # Send request #
-            response = requests.request(request_type, target_url, 
-                                        proxies=proxy, headers=header,
-                                        timeout=5, **kwargs)
-            # Break out of while loop #
-            break
-        except:
-            pass
+    # Send request through the healthiest proxies #
+    response = pool.request(request_type, target_url, max_retries=max_retries, 
+                            headers=header, **kwargs)
     
     return response
 
+######################################################################################################################################
+''' 
+##########          ########## 
+         RESPONSE CACHE 
+##########          ##########  
+'''
+
+class ResponseCache(object):
+    '''
+    Persistent SQLite cache of API responses keyed by (endpoint, symbol, module).
+    Entries are fresh for a per-module TTL. Stale HTTP entries are revalidated
+    with their ETag or Last-Modified header, and the least recently used entries
+    are evicted once the payloads exceed the size budget. In offline mode
+    cached entries are served whatever their age and nothing is requested.
+    Parameters:
+        path          : SQLite filename (incl path). Default value is None (in memory)
+        ttls          : Dictionary of module or endpoint to TTL in seconds. 
+                        Default value is TTLS
+        default_ttl   : TTL for anything else. Default value is 1 day
+        max_bytes     : Size budget of the compressed payloads. Default value is 512MB
+        offline       : Serve from the cache only. Default value is False
+    '''
+    TTLS = {'ticker_list'                      : 86400,
+            'balanceSheetHistory'              : 30*86400,
+            'incomeStatementHistory'           : 30*86400,
+            'cashflowStatementHistory'         : 30*86400,
+            'balanceSheetHistoryQuarterly'     : 7*86400,
+            'incomeStatementHistoryQuarterly'  : 7*86400,
+            'cashflowStatementHistoryQuarterly': 7*86400,
+            'defaultKeyStatistics'             : 86400}
+    
+    def __init__(self, path=None, ttls=None, default_ttl=86400, max_bytes=512e6, offline=False):
+        self.path = path
+        self.ttls = dict(self.TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(':memory:' if path is None else path, 
+                                          check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                   endpoint TEXT, symbol TEXT, module TEXT, payload BLOB, 
+                                   etag TEXT, last_modified TEXT, fetched REAL, accessed REAL, 
+                                   size INTEGER, PRIMARY KEY (endpoint, symbol, module))''')
+        self.connection.commit()
+        ## Running size total of the payloads, kept up to date by put_many and evict ##
+        self.nbytes, = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+    
+    def get_ttl(self, endpoint, module=''):
+        '''
+        Return the TTL of a module, falling back to its endpoint.
+        '''
+        return self.ttls.get(module, self.ttls.get(endpoint, self.default_ttl))
+    
+    def get(self, endpoint, symbol, module=''):
+        '''
+        Return the cached entry or None.
+        Return:
+            entry         : Dictionary of payload, etag, last_modified and fresh
+        '''
+        return self.get_many(endpoint, [symbol], [module]).get((symbol, module))
+    
+    def get_many(self, endpoint, symbols, modules=('',)):
+        '''
+        Return the cached entries of many symbols and modules with one query per 
+        500 symbols, and mark them accessed in a single transaction.
+        Parameters:
+            endpoint      : Cache endpoint name, e.g. get_modules
+            symbols       : List of symbols
+            modules       : List of modules. Default value is ('',)
+        Return:
+            entries       : Dictionary of (symbol, module) to entry (see get) for the
+                            cached pairs only
+        '''
+        symbols, modules = list(symbols), list(modules)
+        rows = []
+        with self.lock:
+            for i in range(0, len(symbols), 500):
+                chunk = symbols[i:i+500]
+                rows += self.connection.execute(
+                    '''SELECT symbol, module, payload, etag, last_modified, fetched FROM responses 
+                       WHERE endpoint=? AND symbol IN (%s) AND module IN (%s)''' 
+                    % (','.join('?'*len(chunk)), ','.join('?'*len(modules))), 
+                    [endpoint] + chunk + modules).fetchall()
+            if rows:
+                now = time.time()
+                with self.connection:
+                    self.connection.executemany('''UPDATE responses SET accessed=? WHERE endpoint=? 
+                                                   AND symbol=? AND module=?''', 
+                                                [(now, endpoint, row[0], row[1]) for row in rows])
+        
+        now = time.time()
+        return {(symbol, module): {'payload'      : json.loads(zlib.decompress(payload)),
+                                   'etag'         : etag,
+                                   'last_modified': last_modified,
+                                   'fresh'        : self.offline or 
+                                                    now - fetched < self.get_ttl(endpoint, module)}
+                for symbol, module, payload, etag, last_modified, fetched in rows}
+    
+    def put(self, endpoint, symbol, module, payload, etag=None, last_modified=None, fetched=None):
+        '''
+        Cache a JSON-serialisable payload and evict entries beyond the size budget.
+        '''
+        self.put_many([{'endpoint': endpoint, 'symbol': symbol, 'module': module, 'payload': payload,
+                        'etag': etag, 'last_modified': last_modified, 'fetched': fetched}])
+    
+    def put_many(self, entries):
+        '''
+        Cache many payloads in a single transaction, then evict entries beyond the 
+        size budget once.
+        Parameter:
+            entries       : List of dictionaries with endpoint, symbol, module and 
+                            payload keys, and optionally etag, last_modified and fetched
+        '''
+        now = time.time()
+        rows = []
+        for entry in entries:
+            blob = zlib.compress(json.dumps(entry['payload'], default=str).encode())
+            rows.append((entry['endpoint'], entry['symbol'], entry.get('module', ''), blob, 
+                         entry.get('etag'), entry.get('last_modified'), 
+                         entry.get('fetched') or now, now, len(blob)))
+        with self.lock, self.connection:
+            ## Keep the running size total - replaced entries release their size ##
+            for row in rows:
+                replaced = self.connection.execute('''SELECT size FROM responses WHERE endpoint=? 
+                                                      AND symbol=? AND module=?''', row[:3]).fetchone()
+                self.nbytes += row[-1] - (replaced[0] if replaced else 0)
+                self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?,?,?)', row)
+            self.evict()
+    
+    def touch(self, endpoint, symbol, module=''):
+        '''
+        Mark a revalidated entry as fresh again.
+        '''
+        with self.lock:
+            self.connection.execute('''UPDATE responses SET fetched=?, accessed=? WHERE endpoint=? 
+                                       AND symbol=? AND module=?''',
+                                    (time.time(), time.time(), endpoint, symbol, module))
+            self.connection.commit()
+    
+    def evict(self):
+        '''
+        Delete least recently used entries beyond the size budget. Caller must hold the lock.
+        '''
+        if self.nbytes <= self.max_bytes:
+            return
+        rows = self.connection.execute('''SELECT endpoint, symbol, module, size FROM responses 
+                                          ORDER BY accessed ASC''').fetchall()
+        for endpoint, symbol, module, size in rows[:-1]:
+            self.connection.execute('DELETE FROM responses WHERE endpoint=? AND symbol=? AND module=?',
+                                    (endpoint, symbol, module))
+            self.nbytes -= size
+            if self.nbytes <= self.max_bytes:
+                break
+    
+    def fetch_json(self, url, endpoint, symbol, module='', session=None, timeout=30, 
+                   stage='fetch_json', **kwargs):
+        '''
+        Return a JSON response, from the cache while it is fresh and otherwise with a 
+        conditional GET request.
+        Parameters:
+            url           : Target URL
+            endpoint      : Cache endpoint name, e.g. ticker_list
+            symbol        : Cache symbol, e.g. exchange or ticker
+            module        : Cache module. Default value is ''
+            session       : requests.Session to use. Default value is None (requests)
+            timeout       : Request timeout in seconds. Default value is 30
+            stage         : Stage name for request metrics. Default value is fetch_json
+            kwargs        : Keyword arguments of requests.get, e.g. params
+        Return:
+            payload       : Decoded JSON response
+            status        : 'hit', 'revalidated' or 'miss'
+        '''
+        entry = self.get(endpoint, symbol, module)
+        if entry is not None and entry['fresh']:
+            return entry['payload'], 'hit'
+        if self.offline:
+            raise KeyError('%s/%s/%s is not cached' % (endpoint, symbol, module))
+        
+        # Revalidate stale entry #
+        headers = dict(kwargs.pop('headers', {}))
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        response = (session or requests).get(url, headers=headers, timeout=timeout, **kwargs)
+        metrics.increment('requests', stage=stage)
+        if response.status_code == 304 and entry is not None:
+            clean_responses(response)
+            self.touch(endpoint, symbol, module)
+            return entry['payload'], 'revalidated'
+        response.raise_for_status()
+        metrics.increment('bytes_downloaded', len(response.content), stage=stage)
+        payload = response.json()
+        self.put(endpoint, symbol, module, payload, etag=response.headers.get('ETag'),
+                 last_modified=response.headers.get('Last-Modified'))
+        clean_responses(response)
+        
+        return payload, 'miss'
+    
+    def preload(self, entries):
+        '''
+        Load entries, e.g. recorded responses for offline runs.
+        Parameter:
+            entries       : List of dictionaries with endpoint, symbol, module and
+                            payload keys, or a JSON lines filename written by dump
+        '''
+        if isinstance(entries, str):
+            with open(entries) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        self.put_many([dict(entry, fetched=None) for entry in entries])
+    
+    def dump(self, filepath):
+        '''
+        Write every entry to a JSON lines file that preload can read.
+        '''
+        with self.lock:
+            rows = self.connection.execute('''SELECT endpoint, symbol, module, payload, etag, 
+                                              last_modified FROM responses''').fetchall()
+        with open(filepath, 'w') as f:
+            for endpoint, symbol, module, payload, etag, last_modified in rows:
+                f.write(json.dumps({'endpoint'     : endpoint,
+                                    'symbol'       : symbol,
+                                    'module'       : module,
+                                    'payload'      : json.loads(zlib.decompress(payload)),
+                                    'etag'         : etag,
+                                    'last_modified': last_modified}) + '\n')
+    
+    def clear(self):
+        '''
+        Delete all entries.
+        '''
+        with self.lock:
+            self.connection.execute('DELETE FROM responses')
+            self.connection.commit()
+            self.nbytes = 0
+
+
+def get_response_cache():
+    '''
+    Return the shared ResponseCache under data_path/Cache, creating it on first use.
+    '''
+    global response_cache
+    if response_cache is None:
+        response_cache = ResponseCache(os.path.join(data_path, 'Cache', 'responses.sqlite'))
+    
+    return response_cache
+
 ######################################################################################################################################
 ''' 
 ##########          ########## 
@@ -83,24 +651,27 @@ def proxy_request(request_type, target_url, **kwargs):
 ##########          ##########  
 '''
    
+@instrument('get_tickers')
 def get_tickers(api_path=None, exchange='SGX'):
     '''
     Send GET request to query exchange traded stocks and their tickers.    
     Parameter:
         api_path      : Filename (incl path) containing World Trading Data's API token
-                        Default value is None
+                        Default value is None (API_TOKENS.parquet under data_path)
         exchange      : Short name for stock exchange. Default value is SGX
     Return:
         tickers       : DataFrame containing exchange stock tickers
     '''
     # Initialise parameters #
-    ## Local download path ##
-    download_path = os.environ['USERPROFILE'] + r'\\\Dropbox\\Personal\\Trading'
-    ## World Trading Data's URL ##
-    wtd_url = 'https://api.worldtradingdata.com/api/v1/ticker_list'
-    ## World Trading Data's API Token ##
-    wtd_token = get_wtd_token(api_path=download_path + r'\API_TOKENS.xlsx', 
-                              token_num=1)
+    ## World Trading Data's URL - see set_api_urls ##
+    wtd_url = api_urls['wtd'] + '/api/v1/ticker_list'
+    ## World Trading Data's API Token - not needed while the cached list is fresh ##
+    if api_path is None:
+        api_path = os.path.join(data_path, 'API_TOKENS.parquet')
+    cache = get_response_cache()
+    cached = cache.get('ticker_list', exchange.upper())
+    wtd_token = None if cache.offline or (cached is not None and cached['fresh']) else \
+                get_wtd_token(api_path=api_path, token_num=1)
     ## WTD's parameters ##
     params = {
         'type'          : 'stocks',
@@ -111,22 +682,36 @@ def get_tickers(api_path=None, exchange='SGX'):
     ## Exchange ##
     exchange = exchange.upper()
     
-    # Send GET request to query all stocks #
-    response = requests.get(wtd_url, params=params)
-    results = response.json()
-    
-    # Free up memory #
-    clean_responses(response)
+    # Send GET request to query all stocks - served from the response cache while fresh #
+    results, status = cache.fetch_json(wtd_url, 'ticker_list', exchange, params=params, 
+                                       stage='get_tickers')
+    metrics.increment('cache_' + status, stage='get_tickers')
     
     # Convert results into DataFrame #
+    tickers = parse_tickers(results)
+    
+    # Download DataFrame unless it is unchanged - see export_excel for Excel #
+    if status == 'miss' or not os.path.exists(get_tickers_path(exchange)):
+        os.makedirs(os.path.dirname(get_tickers_path(exchange)), exist_ok=True)
+        tickers.to_parquet(get_tickers_path(exchange), index=False)
+        metrics.increment('rows_written', len(tickers), stage='get_tickers')
+    
+    return tickers
+    
+
+def parse_tickers(results):
+    '''
+    Convert World Trading Data's ticker list into a DataFrame.
+    Parameter:
+        results       : List of dictionaries from the ticker_list endpoint
+    Return:
+        tickers       : DataFrame containing exchange stock tickers
+    '''
     tickers = pd.DataFrame(results)
     tickers.drop_duplicates(subset=['symbol'], inplace=True)
     tickers = tickers[['symbol', 'name', 'currency']]
     tickers.columns = ['TICKER', 'COMPANY', 'CURRENCY']
     
-    # Download DataFrame #
-    tickers.to_excel('%s_TICKERS.xlsx' % exchange, sheet_name='TICKERS', index=False)
-    
     return tickers
     
 
@@ -142,348 +727,3580 @@ def get_wtd_token(api_path=None, token_num=None):
     # WTD token is set by user's input #
     if api_path is None:
         wtd_token = input("Please key in WTD's token that was assigned to you: ")
-    # WTD token is set by Excel's inputs #
+    # WTD token is set by the tokens table #
     else:
-        api_tokens = pd.read_excel(api_path)
+        api_tokens = read_table(api_path)
         wtd_token = api_tokens.loc[api_tokens['APPLICATION']=='WorldTradingData_' + \
                                    str(token_num), 'KEY'].iloc[0]
     
     return wtd_token
 
 
-def get_historical(exchange='SGX', start_year=2018, interval='1d'):
+@instrument('get_historical')
+def get_historical(exchange='SGX', start_year=2018, interval='1d', store=None, 
+                   incremental=False, batch_size=50, max_workers=4, sessions_back=4,
+                   parse_workers=2, queue_size=2):
     '''
     Query latest historical prices of stocks.    
     Parameters:
         exchange      : Short name for stock exchange. Default value is SGX
         start_year    : Reference start year. Default value is 2018
         interval      : Reference interval period. Default value is daily
+        store         : PriceStore to write into. Default value is the Parquet store
+        incremental   : Only download dates after the last stored date (daily prices).
+                        Default value is False
+        batch_size    : Number of tickers per request. Default value is 50
+        max_workers   : Number of concurrent requests. Default value is 4
+        sessions_back : Intraday only - number of SGX sessions before the latest one
+                        to download. Default value is 4
+        parse_workers : Number of threads normalising downloaded batches. Default value is 2
+        queue_size    : Number of batches waiting between stages. Default value is 2
+    Return:
+        timings       : DataFrame of wall time per batch
+        throughput    : DataFrame of records per second and timings per pipeline stage
     '''
     # Initialise parameter #
     ## Tickers ##
-    filepath = re.split(exchange, download_path)[0]
-    stocks = pd.read_excel(filepath + exchange + '_TICKERS.xlsx')
+    stocks = read_table(get_tickers_path(exchange))
     target_tickers = list(stocks['TICKER'])
+    ## Price store ##
+    if store is None:
+        store = get_price_store()
+    
+    # Refresh stored daily prices incrementally #
+    if incremental and interval == '1d':
+        backfilled, timings, throughput = update_historical(stocks, start_year=start_year, 
+                                                            store=store, batch_size=batch_size, 
+                                                            max_workers=max_workers, 
+                                                            parse_workers=parse_workers, 
+                                                            queue_size=queue_size)
+        return timings, throughput
 
     # Get historical prices - Default end date is now #
-    tickers = Ticker(target_tickers)
     if interval == '1d':
-        historical = tickers.history(start=dt.datetime(start_year,1,1),
-                                     end=dt.datetime.now())
+        params = {'start': dt.datetime(start_year,1,1),
+                  'end'  : dt.datetime.now()}
     else:
+        ## Last sessions_back + 1 sessions, within Yahoo's 7-day intraday limit ##
         first_recent = get_working_day()
-        second_recent = first_recent - dt.timedelta(7)
-        historical = tickers.history(interval=interval,
-                                     start=second_recent,
-                                     end=first_recent)
+        second_recent = get_trading_calendar().sessions_back(first_recent, sessions_back).astype(dt.date)
+        end = first_recent + dt.timedelta(1)
+        params = {'interval': interval,
+                  'start'   : max(second_recent, end - dt.timedelta(7)),
+                  'end'     : end}
     
-    # Access each ticker and output data #
-    for target_ticker in target_tickers:
-        target = historical[target_ticker]
-        company = stocks.loc[stocks['TICKER'] == target_ticker, 'COMPANY'].iloc[0] 
-        try:
-            # target.index = [timestamp.date() for timestamp in list(target.index)]
-            target.index.name = 'date'
-            target.sort_index(ascending=False, inplace=True)
-            if interval == '1d':
-                target.to_csv(download_path + '\\' + exchange + \
-                              r'\Prices\Daily\%s_%s.csv' % (target_ticker, company))
-            else:
-                target.dropna(inplace=True)
-                target.to_csv(download_path + '\\' + exchange + \
-                              r'\Prices\Minute\%s_%s.csv' % (target_ticker, company))
-        except:
-            pass
+    # Stream batches through download, normalise and write stages #
+    companies = dict(zip(stocks['TICKER'], stocks['COMPANY']))
+    def write(params, target_ticker, target):
+        store.write(target_ticker, target, interval, companies[target_ticker])
+        metrics.increment('rows_written', len(target), stage='get_historical')
+    pipeline, timings = make_history_pipeline(write, max_workers=max_workers, 
+                                              parse_workers=parse_workers, queue_size=queue_size)
+    throughput = pipeline.run((batch_num, target_tickers[i:i+batch_size], params)
+                              for batch_num, i in enumerate(range(0, len(target_tickers), batch_size)))
+    store.save_index()
+    timings = pd.DataFrame(timings, columns=['BATCH', 'TICKERS', 'SECONDS', 'ATTEMPTS', 'FAILED'])
+    timings = timings.sort_values('BATCH').reset_index(drop=True)
+    
+    return timings, throughput
+
+
+def update_historical(stocks, start_year=2018, store=None, overlap=5, tolerance=1e-4,
+                      batch_size=50, max_workers=4, parse_workers=2, queue_size=2):
+    '''
+    Append only the missing daily prices to the store. The last few stored dates 
+    are downloaded again and if their adjclose changed (dividend or split 
+    adjustment), the ticker's full history is downloaded again.
+    Parameters:
+        stocks        : DataFrame of tickers and company names (see get_tickers)
+        start_year    : Reference start year for new or backfilled tickers. 
+                        Default value is 2018
+        store         : PriceStore to update. Default value is the Parquet store
+        overlap       : Number of stored days downloaded again for comparison. 
+                        Default value is 5
+        tolerance     : Relative adjclose change treated as an adjustment.
+                        Default value is 1e-4
+        batch_size    : Number of tickers per request. Default value is 50
+        max_workers   : Number of concurrent requests. Default value is 4
+        parse_workers : Number of threads normalising downloaded batches. Default value is 2
+        queue_size    : Number of batches waiting between stages. Default value is 2
+    Return:
+        backfilled    : List of tickers whose full history was downloaded again
+        timings       : DataFrame of wall time per batch
+        throughput    : DataFrame of records per second and timings per pipeline stage
+    '''
+    # Initialise parameters #
+    if store is None:
+        store = get_price_store()
+    companies = dict(zip(stocks['TICKER'], stocks['COMPANY']))
+    first_date = dt.datetime(start_year,1,1)
+    stored = store.index.get('1d', {})
+    backfilled = []
+    
+    # Store new tickers in full and append missing dates unless they were adjusted #
+    def write(params, target_ticker, target):
+        ## New or backfilled ticker - store full history ##
+        if params['start'] == first_date:
+            store.write(target_ticker, target, '1d', companies[target_ticker])
+            metrics.increment('rows_written', len(target), stage='update_historical')
+            return
+        ## Detect adjustments on overlapping dates ##
+        existing = store.read(target_ticker, columns=['adjclose'], start=target.index[0])
+        common = existing.index.intersection(target.index)
+        if not np.allclose(existing.loc[common, 'adjclose'].values,
+                           target.loc[common, 'adjclose'].values, 
+                           rtol=tolerance, equal_nan=True):
+            backfilled.append(target_ticker)
+            metrics.log('adjustment', stage='update_historical', ticker=target_ticker)
+        else:
+            store.append(target_ticker, target, '1d', companies[target_ticker])
+            metrics.increment('rows_written', len(target), stage='update_historical')
+    pipeline, timings = make_history_pipeline(write, max_workers=max_workers, 
+                                              parse_workers=parse_workers, queue_size=queue_size, 
+                                              stage='update_historical')
+    
+    # Group tickers by the first date to request #
+    groups = {}
+    for target_ticker in companies:
+        last_date = stored.get(target_ticker, {}).get('end')
+        if last_date is None:
+            start = first_date
+        else:
+            start = pd.Timestamp(last_date).to_pydatetime() - dt.timedelta(overlap)
+        groups.setdefault(start, []).append(target_ticker)
+    
+    # Stream the missing range per group #
+    end = dt.datetime.now()
+    batches = [(start, group[i:i+batch_size]) for start, group in groups.items() 
+               for i in range(0, len(group), batch_size)]
+    pipeline.run((batch_num, batch, {'start': start, 'end': end}) 
+                 for batch_num, (start, batch) in enumerate(batches))
+    
+    # Backfill adjusted tickers #
+    if backfilled:
+        pipeline.run((len(batches) + batch_num, backfilled[i:i+batch_size], 
+                      {'start': first_date, 'end': end})
+                     for batch_num, i in enumerate(range(0, len(backfilled), batch_size)))
+    store.save_index()
+    timings = pd.DataFrame(timings, columns=['BATCH', 'TICKERS', 'SECONDS', 'ATTEMPTS', 'FAILED'])
+    timings = timings.sort_values('BATCH').reset_index(drop=True)
+    
+    return backfilled, timings, pipeline.get_throughput()
+
+
+def split_history(historical, ticker):
+    '''
+    Return one ticker's prices from a multi-ticker YahooQuery history.
+    Parameters:
+        historical    : Dictionary or (symbol, date) indexed DataFrame from Ticker.history
+        ticker        : Target ticker
+    Return:
+        target        : DataFrame of prices indexed by date
+    '''
+    if isinstance(historical, pd.DataFrame):
+        target = historical.xs(ticker, level='symbol')
+    else:
+        target = historical[ticker]
+    target.index = pd.to_datetime(target.index)
+    target.index.name = 'date'
+    
+    return target
     
 ######################################################################################################################################
 ''' 
 ##########          ########## 
-       STOCK FUNDAMENTALS 
+         PRICE STORAGE 
 ##########          ##########  
 '''
 
-def get_financials(exchange='SGX', delimiter='.SI'):
+class PriceStore(object):
     '''
-    Query stock financials (quarterly and annual).    
+    Base class for on-disk historical price storage keyed by ticker and interval.
+    A JSON index maps each (interval, ticker) to its file and date range so that
+    readers never need to list or pattern-match the storage directory.
     Parameter:
-        exchange      : Short name for stock exchange. Default value is SGX
-        delimiter     : RIC code accompanying tickers
+        root          : Root directory of the store
     '''
-    # Initialise parameters #
-    ## Tickers ##
-    filepath = re.split(exchange, download_path)[0]
-    stocks = pd.read_excel(filepath + exchange + '_TICKERS.xlsx')
-    target_tickers = list(stocks['TICKER'])
-    ## Modules ##
-    modules = ['balanceSheetHistory', 'balanceSheetHistoryQuarterly',
-               'incomeStatementHistory', 'incomeStatementHistoryQuarterly',
-               'cashflowStatementHistory', 'cashflowStatementHistoryQuarterly',
-               'defaultKeyStatistics']
-    ## Errata tickers ##
-    errata = []
-    ## Empty DataFrames ##
-    bal_sheet = pd.DataFrame([{'symbol' : np.nan, 'periodType': np.nan}])
-    inc_statement = pd.DataFrame([{'symbol' : np.nan, 'periodType': np.nan}])
-    cf_statement = pd.DataFrame([{'symbol' : np.nan, 'periodType': np.nan}])
-    fin_ratios = pd.DataFrame([{'symbol' : np.nan}])
+    extension = None
     
-    # Get stock fundamnetals - Balance Sheet, Income Statement, Cash Flow #
-    while True:
-        if errata:
-            target_tickers = [target_ticker for target_ticker in target_tickers 
-                              if target_ticker not in errata]
-        tickers = Ticker(target_tickers)
-        try:
-            data = tickers.get_modules(modules)
-        except Exception as e:
-            ## Get errata tickers ##
-            errata.append(re.split('/', re.split(r'\%s' % delimiter, str(e))[0])[-1] + delimiter)
-            print(errata)
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, '_index.json')
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
         else:
-            ## Retrieve working data for errata_tickers ##
-            print('--Commence processing DataFrames--')
-            if errata:
-                for ticker in errata:
-                    errata_ticker = Ticker(ticker)
-                    for module in modules:
-                        try:
-                            errata_data = errata_ticker.get_modules(module)
-                        except:
-                            pass
-                        else:
-                            ## Combine dictionaries ##
-                            for key, value in errata_data.items():
-                                data.update({key:value})            
-                ## Merge tickers ##
-                target_tickers += errata
-            
-            ## Convert dictionaries into DataFrames ##
-            for target_ticker in target_tickers:
-                for module in modules:
-                    ### Balance Sheet ###
-                    if re.search('balanceSheetHistory', module):
-                        try:
-                            bal_sheet = pd.concat([bal_sheet,
-                                    pd.DataFrame(data[target_ticker][module]['balanceSheetStatements'])],
-                                              axis=0)
-                        except:
-                            pass
-                        else:
-                            bal_sheet = get_period_type(bal_sheet, target_ticker, module)
-                    ### Income Statement ###
-                    elif re.search('incomeStatementHistory', module):
-                        try:
-                            inc_statement = pd.concat([inc_statement,
-                                        pd.DataFrame(data[target_ticker][module]['incomeStatementHistory'])],
-                                              axis=0)
-                        except:
-                            pass
-                        else:
-                            inc_statement = get_period_type(inc_statement, target_ticker, module)
-                    ### Cash Flow Statement ###
-                    elif re.search('cashflowStatementHistory', module):
-                        try:
-                            cf_statement = pd.concat([cf_statement,
-                                        pd.DataFrame(data[target_ticker][module]['cashflowStatements'])],
-                                              axis=0)
-                        except:
-                            pass
-                        else:
-                            cf_statement = get_period_type(cf_statement, target_ticker, module)
-                    ### Financial Ratios ###
-                    else:
-                        try:
-                            fin_ratios = pd.concat([fin_ratios,
-                                        pd.DataFrame([data[target_ticker][module]])],
-                                              axis=0)
-                        except:
-                            pass
-                        else:
-                            fin_ratios.loc[fin_ratios['symbol'].isnull(), 'symbol'] = target_ticker
-            
-            ## Drop the first row ##
-            bal_sheet.index = range(0, len(bal_sheet))
-            bal_sheet = bal_sheet.iloc[1:]
-            inc_statement.index = range(0, len(inc_statement))
-            inc_statement = inc_statement.iloc[1:]
-            cf_statement.index = range(0, len(cf_statement))
-            cf_statement = cf_statement.iloc[1:]
-            fin_ratios.index = range(0, len(fin_ratios))
-            fin_ratios = fin_ratios.iloc[1:]
-            
-            ## Download DataFrames ## 
-            writer = pd.ExcelWriter(download_path + '\\' + exchange + r'\FIN_STATEMENTS.xlsx', 
-                                    engine='xlsxwriter')
-            bal_sheet.to_excel(writer, sheet_name='BS', index=False)
-            inc_statement.to_excel(writer, sheet_name='IS', index=False)
-            cf_statement.to_excel(writer, sheet_name='CFS', index=False)
-            fin_ratios.to_excel(writer, sheet_name='RATIOS', index=False)
-            writer.save()
-            print('--Complete processing--')
-            
-            ## Break out of while loop ##
-            break
-            
-    return data, bal_sheet, inc_statement, cf_statement, fin_ratios
+            self.index = {}
+    
+    def get_path(self, ticker, interval, company=None):
+        '''
+        Return the filename (incl path) of a ticker's partition.
+        '''
+        return os.path.join(self.root, interval, ticker + self.extension)
+    
+    def write(self, ticker, df, interval='1d', company=None, invalidate=True):
+        '''
+        Overwrite a ticker's prices. Replacing stored history (e.g. a backfill of 
+        adjusted prices) drops the ticker's cached indicators.
+        Parameters:
+            ticker        : Target ticker
+            df            : DataFrame of prices indexed by date
+            interval      : Reference interval period. Default value is daily
+            company       : Company name, kept in the index
+            invalidate    : Drop cached indicators of a stored ticker. Default value is True
+        '''
+        if invalidate and ticker in self.index.get(interval, {}) and indicator_cache is not None:
+            indicator_cache.invalidate(ticker)
+        
+        # Normalise DataFrame #
+        df = df.copy()
+        df.index.name = 'date'
+        df = df[~df.index.duplicated(keep='last')].sort_index(ascending=True)
+        
+        # Write partition and update index #
+        filepath = self.get_path(ticker, interval, company)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        self._write(filepath, df)
+        self.index.setdefault(interval, {})[ticker] = {
+            'path'   : os.path.relpath(filepath, self.root),
+            'company': company,
+            'start'  : str(df.index[0]) if len(df) else None,
+            'end'    : str(df.index[-1]) if len(df) else None,
+            'rows'   : len(df),
+            }
+    
+    def append(self, ticker, df, interval='1d', company=None):
+        '''
+        Add new prices to a ticker's stored prices. Dates already stored are 
+        replaced by the new prices.
+        Parameters:
+            ticker        : Target ticker
+            df            : DataFrame of new prices indexed by date
+            interval      : Reference interval period. Default value is daily
+            company       : Company name, kept in the index
+        '''
+        if ticker in self.index.get(interval, {}):
+            df = pd.concat([self.read(ticker, interval), df], axis=0)
+            company = company or self.index[interval][ticker].get('company')
+        self.write(ticker, df, interval, company, invalidate=False)
+    
+    def read(self, ticker, interval='1d', columns=None, start=None, end=None):
+        '''
+        Read a ticker's prices.
+        Parameters:
+            ticker        : Target ticker
+            interval      : Reference interval period. Default value is daily
+            columns       : List of columns to load. Default value is None (all)
+            start         : Earliest date to load (inclusive). Default value is None
+            end           : Latest date to load (inclusive). Default value is None
+        Return:
+            df            : DataFrame of prices indexed by date in ascending order
+        '''
+        entry = self.index[interval][ticker]
+        filepath = os.path.join(self.root, entry['path'])
+        start = None if start is None else pd.Timestamp(start)
+        end = None if end is None else pd.Timestamp(end)
+        
+        return self._read(filepath, columns, start, end)
+    
+    def tickers(self, interval='1d'):
+        '''
+        Return the list of tickers stored for the interval.
+        '''
+        return list(self.index.get(interval, {}))
+    
+    def save_index(self):
+        '''
+        Persist the ticker index to disk.
+        '''
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.index_path, 'w') as f:
+            json.dump(self.index, f, indent=1)
+    
+    
+class ParquetStore(PriceStore):
+    '''
+    Price store partitioned into one Parquet file per interval and ticker.
+    Only the requested columns are decoded and date filters are pushed down
+    to the Parquet reader.
+    '''
+    extension = '.parquet'
+    
+    def _write(self, filepath, df):
+        df.reset_index().to_parquet(filepath, index=False, row_group_size=5000)
+    
+    def _read(self, filepath, columns, start, end):
+        # Build row filters on date #
+        filters = []
+        if start is not None:
+            filters.append(('date', '>=', start))
+        if end is not None:
+            filters.append(('date', '<=', end))
+        
+        # Load target columns only #
+        df = pd.read_parquet(filepath, 
+                             columns=None if columns is None else ['date'] + list(columns),
+                             filters=filters or None)
+        
+        return df.set_index('date')
 
 
-def get_period_type(fs, ticker, module):
+class CSVStore(PriceStore):
     '''
-    Returns the symbol and period type for the target financial statement.
+    Price store using the legacy <TICKER>_<COMPANY>.csv files under Daily and
+    Minute folders, sorted with the latest date first.
+    '''
+    extension = '.csv'
+    
+    def __init__(self, root):
+        super(CSVStore, self).__init__(root)
+        # Index legacy files that were written before the index existed #
+        for interval, folder in [('1d', 'Daily'), ('1m', 'Minute')]:
+            if interval not in self.index and os.path.isdir(os.path.join(root, folder)):
+                self.index[interval] = {file.split('_')[0]: 
+                                        {'path'   : os.path.join(folder, file),
+                                         'company': file[:-len(self.extension)].split('_', 1)[-1]}
+                                        for file in os.listdir(os.path.join(root, folder))
+                                        if file.endswith(self.extension)}
+    
+    def get_path(self, ticker, interval, company=None):
+        folder = 'Daily' if interval == '1d' else 'Minute'
+        return os.path.join(self.root, folder, '%s_%s.csv' % (ticker, company))
+    
+    def _write(self, filepath, df):
+        df.sort_index(ascending=False).to_csv(filepath)
+    
+    def _read(self, filepath, columns, start, end):
+        df = pd.read_csv(filepath, 
+                         usecols=None if columns is None else ['date'] + list(columns),
+                         parse_dates=['date'], index_col='date')
+        df = df[~df.index.duplicated(keep='last')].sort_index(ascending=True)
+        
+        return df.loc[start:end]
+
+
+def get_price_store(store_format='parquet', root=None):
+    '''
+    Return the price store for the requested format.
     Parameters:
-        fs               : Target financial statement
-        ticker           : Target ticker 
-        module           : Name of YahooQuery module
+        store_format  : 'parquet' or 'csv'. Default value is parquet
+        root          : Root directory of the store. Default value is price_path
     Return:
-        fs               : Updated financial statement
+        store         : PriceStore instance
     '''
-    # Fill up symbol #
-    fs.loc[fs['symbol'].isnull(), 'symbol'] = ticker
+    stores = {'parquet': ParquetStore, 'csv': CSVStore}
     
-    # Fill up period type #
-    if not re.search(r'Quarterly', module):
-        fs.loc[fs['periodType'].isnull(), 'periodType'] = '12M'
-    else:
-        fs.loc[fs['periodType'].isnull(), 'periodType'] = '3M'
+    return stores[store_format](price_path if root is None else root)
 
-    return fs
 
+def export_prices(src, dst, interval='1d', tickers=None):
+    '''
+    Copy stored prices from one store to another, e.g. Parquet to CSV.
+    Parameters:
+        src           : Source PriceStore
+        dst           : Destination PriceStore
+        interval      : Reference interval period. Default value is daily
+        tickers       : List of tickers to export. Default value is None (all)
+    '''
+    for ticker in (src.tickers(interval) if tickers is None else tickers):
+        company = src.index[interval][ticker].get('company')
+        dst.write(ticker, src.read(ticker, interval), interval, company)
+    dst.save_index()
+    
 ######################################################################################################################################
 ''' 
 ##########          ########## 
-         MISCELLANEOUS 
+           PRICE PANEL 
 ##########          ##########  
 '''
 
-def clean_responses(response, soup=None):
+class PricePanel(object):
     '''
-    Clear all the the responses to free up memory 
+    Compact multi-ticker price panel. Every ticker's bars are stored back to back
+    in one contiguous float32 array per field, with int64 timestamps (nanoseconds
+    since epoch) and offsets locating each ticker's rows. Per-ticker and date window
+    slices are views, and a saved panel can be memory-mapped instead of loaded.
     Parameters:
-        response      : Response from GET requests
-        soup          : Parsed BeautifulSoup     
+        values        : 2D float32 array of prices (field x row)
+        timestamps    : 1D int64 array of timestamps (row)
+        offsets       : 1D int64 array of each ticker's first row, plus the total rows
+        tickers       : List of tickers in row order
+        fields        : List of field names. Default value is FIELDS
     '''
-    # Close response #
-    response.close()
-    response = None
+    FIELDS = ['open', 'high', 'low', 'close', 'adjclose', 'volume']
     
-    # Decompose soup if soup is valid #
-    if soup is not None:
-        soup.decompose()
+    def __init__(self, values, timestamps, offsets, tickers, fields=None):
+        self.values = values
+        self.timestamps = timestamps
+        self.offsets = offsets
+        self.tickers = list(tickers)
+        self.fields = list(self.FIELDS if fields is None else fields)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.field_index = {field: i for i, field in enumerate(self.fields)}
+    
+    @property
+    def nbytes(self):
+        '''
+        Return the memory size of the panel arrays.
+        '''
+        return self.values.nbytes + self.timestamps.nbytes + self.offsets.nbytes
+    
+    @classmethod
+    def from_store(cls, tickers='all', store=None, interval='1d', fields=None, path=None):
+        '''
+        Build a panel from stored prices, reading one ticker at a time.
+        Parameters:
+            tickers       : List of tickers or 'all'. Default value is 'all'
+            store         : PriceStore to read from. Default value is the Parquet store
+            interval      : Reference interval period. Default value is daily
+            fields        : List of columns to keep. Default value is FIELDS
+            path          : Folder to write the panel to and memory-map, so that it 
+                            is never held in memory. Default value is None (in memory)
+        Return:
+            panel         : PricePanel
+        '''
+        # Locate stored tickers #
+        if store is None:
+            store = get_price_store()
+        if tickers == 'all':
+            tickers = store.tickers(interval)
+        fields = list(cls.FIELDS if fields is None else fields)
         
-    # Clear all the waste #
-    gc.collect()
+        # Count rows from the index, or a dates-only read for legacy entries #
+        lengths, tickers_read = [], []
+        for ticker in tickers:
+            entry = store.index.get(interval, {}).get(ticker, {})
+            n_rows = entry['rows'] if 'rows' in entry else len(store.read(ticker, interval, columns=[]))
+            if n_rows == 0:
+                continue
+            lengths.append(n_rows)
+            tickers_read.append(ticker)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        n_rows = int(offsets[-1])
+        
+        # Allocate the panel arrays #
+        if path is None:
+            values = np.empty((len(fields), n_rows), dtype=np.float32)
+            timestamps = np.empty(n_rows, dtype=np.int64)
+        else:
+            os.makedirs(path, exist_ok=True)
+            values = np.lib.format.open_memmap(os.path.join(path, 'values.npy'), mode='w+',
+                                               dtype=np.float32, shape=(len(fields), n_rows))
+            timestamps = np.lib.format.open_memmap(os.path.join(path, 'timestamps.npy'), mode='w+',
+                                                   dtype=np.int64, shape=(n_rows,))
+        
+        # Read one ticker at a time straight into its slice #
+        for i, ticker in enumerate(tickers_read):
+            df = store.read(ticker, interval, columns=fields)
+            if len(df) != lengths[i]:
+                raise ValueError('Index of %s lists %d rows but %d were read - rebuild the store index'
+                                 % (ticker, lengths[i], len(df)))
+            timestamps[offsets[i]:offsets[i+1]] = df.index.values.astype('datetime64[ns]').view(np.int64)
+            values[:, offsets[i]:offsets[i+1]] = df.values.T
+            del df
+        panel = cls(values, timestamps, offsets, tickers_read, fields)
+        if path is not None:
+            panel.save(path)
+            panel = cls.load(path)
+        
+        return panel
     
-
-def get_working_day():
-    '''
-    Returns the previous working day if today is not a working day.
-    Return:
-        working_day   : Previous working day in datetime format
-    '''
-    # Initiate parameters #
-    ## Today's date ##
-    today = dt.datetime.now().date()
-    working_day = today
-    ## Day of the week ##
-    weekday = today.weekday()
+    def save(self, path):
+        '''
+        Write the panel to a folder of .npy arrays and a JSON header.
+        '''
+        os.makedirs(path, exist_ok=True)
+        for name in ['values', 'timestamps', 'offsets']:
+            filepath = os.path.join(path, name + '.npy')
+            array = getattr(self, name)
+            ## Skip arrays already memory-mapped to this file ##
+            if getattr(array, 'filename', None) != os.path.abspath(filepath):
+                np.save(filepath, array)
+            elif isinstance(array, np.memmap):
+                array.flush()
+        with open(os.path.join(path, 'panel.json'), 'w') as f:
+            json.dump({'tickers': self.tickers, 'fields': self.fields}, f)
     
-    while weekday >= 5:
-        # Decrease counter #
-        working_day -= dt.timedelta(1)
-        weekday -= 1
+    @classmethod
+    def load(cls, path, mmap=True):
+        '''
+        Load a saved panel.
+        Parameters:
+            path          : Folder written by save
+            mmap          : Memory-map the arrays read-only instead of reading them.
+                            Default value is True
+        Return:
+            panel         : PricePanel
+        '''
+        with open(os.path.join(path, 'panel.json')) as f:
+            header = json.load(f)
+        arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                  for name in ['values', 'timestamps', 'offsets']]
+        
+        return cls(*arrays, tickers=header['tickers'], fields=header['fields'])
     
-    return working_day
+    def get_rows(self, ticker, start=None, end=None):
+        '''
+        Return the row slice of a ticker's bars between start and end (inclusive).
+        '''
+        i = self.ticker_index[ticker]
+        first, last = int(self.offsets[i]), int(self.offsets[i+1])
+        timestamps = self.timestamps[first:last]
+        if start is not None:
+            first += int(np.searchsorted(timestamps, pd.Timestamp(start).value, side='left'))
+        if end is not None:
+            last = int(self.offsets[i]) + int(np.searchsorted(timestamps, pd.Timestamp(end).value, 
+                                                              side='right'))
+        
+        return slice(first, max(first, last))
+    
+    def get(self, ticker, fields=None, start=None, end=None):
+        '''
+        Return views of a ticker's bars - no data is copied.
+        Parameters:
+            ticker        : Target ticker
+            fields        : Field name or list of field names. Default value is None (all)
+            start         : Earliest date (inclusive). Default value is None
+            end           : Latest date (inclusive). Default value is None
+        Return:
+            timestamps    : 1D int64 array of timestamps
+            values        : 1D (one field) or 2D (field x row) float32 array of prices
+        '''
+        rows = self.get_rows(ticker, start, end)
+        if fields is None:
+            values = self.values[:, rows]
+        elif isinstance(fields, str):
+            values = self.values[self.field_index[fields], rows]
+        else:
+            ## Consecutive fields stay a view ##
+            index = [self.field_index[field] for field in fields]
+            if index == list(range(index[0], index[0] + len(index))):
+                values = self.values[index[0]:index[-1]+1, rows]
+            else:
+                values = self.values[index][:, rows]
+        
+        return self.timestamps[rows], values
+    
+    def select(self, tickers):
+        '''
+        Return a panel of the tickers. Consecutive tickers share this panel's 
+        memory, any other selection is copied.
+        '''
+        tickers = list(tickers)
+        first, last = self.ticker_index[tickers[0]], self.ticker_index[tickers[-1]] + 1
+        if self.tickers[first:last] == tickers:
+            offsets = self.offsets[first:last+1]
+            rows = slice(int(offsets[0]), int(offsets[-1]))
+            return PricePanel(self.values[:, rows], self.timestamps[rows], offsets - offsets[0],
+                              tickers, self.fields)
+        
+        # Gather rows of scattered tickers #
+        rows = [self.get_rows(ticker) for ticker in tickers]
+        offsets = np.concatenate([[0], np.cumsum([row.stop - row.start for row in rows])])
+        
+        return PricePanel(np.concatenate([self.values[:, row] for row in rows], axis=1),
+                          np.concatenate([self.timestamps[row] for row in rows]),
+                          offsets.astype(np.int64), tickers, self.fields)
+    
+    def estimate_dates(self):
+        '''
+        Return an upper estimate of the number of distinct dates from each ticker's 
+        first and last timestamps, without reading the timestamps in between. The 
+        densest ticker's bars per unit of time is applied to the whole date range.
+        '''
+        lengths = np.diff(self.offsets)
+        has_rows = lengths > 0
+        if not has_rows.any():
+            return 1
+        first = self.timestamps[self.offsets[:-1][has_rows]].astype(np.float64)
+        last = self.timestamps[self.offsets[1:][has_rows] - 1].astype(np.float64)
+        lengths, spans = lengths[has_rows], last - first
+        
+        # Scale the densest ticker to the full range, capped by the total rows #
+        n_dates = int(lengths.max())
+        if (spans > 0).any():
+            density = ((lengths[spans > 0] - 1) / spans[spans > 0]).max()
+            n_dates = max(n_dates, int(np.ceil(density*(last.max() - first.min()))) + 1)
+        
+        return max(min(n_dates, int(lengths.sum())), 1)
+    
+    def iter_chunks(self, max_bytes=256e6, bytes_per_cell=8*20):
+        '''
+        Yield sub-panels of consecutive tickers whose dense (date x ticker) working 
+        set stays within the memory budget.
+        Parameters:
+            max_bytes      : Memory budget per chunk. Default value is 256MB
+            bytes_per_cell : Working bytes per (date, ticker) cell, i.e. float64 
+                             prices, indicators and returns. Default value is 160
+        Yield:
+            panel          : PricePanel
+        '''
+        n_dates = self.estimate_dates()
+        chunk_size = max(int(max_bytes // (n_dates*bytes_per_cell)), 1)
+        for i in range(0, len(self.tickers), chunk_size):
+            yield self.select(self.tickers[i:i+chunk_size])
+    
+    def to_frame(self, field, tickers=None, dtype=np.float64):
+        '''
+        Return one field as a date-aligned DataFrame (date x ticker).
+        Parameters:
+            field         : Field name, e.g. adjclose
+            tickers       : List of tickers. Default value is None (all)
+            dtype         : Data type of the frame. Default value is float64
+        Return:
+            df            : DataFrame indexed by date
+        '''
+        tickers = self.tickers if tickers is None else tickers
+        rows = [self.get_rows(ticker) for ticker in tickers]
+        dates = np.unique(np.concatenate([self.timestamps[row] for row in rows] or 
+                                         [np.empty(0, dtype=np.int64)]))
+        frame = np.full((len(dates), len(tickers)), np.nan, dtype=dtype)
+        values = self.values[self.field_index[field]]
+        for col, row in enumerate(rows):
+            frame[np.searchsorted(dates, self.timestamps[row]), col] = values[row]
+        
+        return pd.DataFrame(frame, index=pd.DatetimeIndex(dates.view('datetime64[ns]'), name='date'),
+                            columns=tickers)
     
 ######################################################################################################################################
 ''' 
 ##########          ########## 
-       TECHNICAL ANALYSIS 
+       STOCK FUNDAMENTALS 
 ##########          ##########  
 '''
 
-def test_strat(ticker):
-    ''' 
-    Trading strategy using Parabolic SAR and Stochastic Oscillator.
-    
-    Brief description of trading strategy:
-    We BUY when the (i) parabolic SAR line appears below the closing price and
-    (ii) the fast stochastic crosses above the slow stochastic. A SAR line that 
-    appears below the market price indicates an uptrend and since fast 
-    stochastics is more sensitive to price and when it crosses above the slow 
-    stochastic, it indicates the reversal in price direction from downward to 
+@instrument('get_financials')
+def get_financials(exchange='SGX', delimiter='.SI', batch_size=50, max_workers=4, cache=None):
+    '''
+    Query stock financials (quarterly and annual).    
+    Parameter:
+        exchange      : Short name for stock exchange. Default value is SGX
+        delimiter     : RIC code accompanying tickers
+        batch_size    : Number of tickers per request. Default value is 50
+        max_workers   : Number of concurrent requests. Default value is 4
+        cache         : ResponseCache for the modules. Default value is the shared cache
+    '''
+    # Initialise parameters #
+    ## Tickers ##
+    stocks = read_table(get_tickers_path(exchange))
+    target_tickers = list(stocks['TICKER'])
+    ## Response cache ##
+    if cache is None:
+        cache = get_response_cache()
+    ## Modules ##
+    modules = ['balanceSheetHistory', 'balanceSheetHistoryQuarterly',
+               'incomeStatementHistory', 'incomeStatementHistoryQuarterly',
+               'cashflowStatementHistory', 'cashflowStatementHistoryQuarterly',
+               'defaultKeyStatistics']
+    
+    # Get stock fundamnetals - Balance Sheet, Income Statement, Cash Flow #
+    ## Failed batches are narrowed down to failed tickers and retried ##
+    data, errata, timings = fetch_batches(lambda batch: fetch_modules(batch, modules, cache), 
+                                          target_tickers, batch_size=batch_size, 
+                                          max_workers=max_workers, retries=0 if cache.offline else 3,
+                                          stage='get_financials')
+    metrics.log('processing', stage='get_financials', tickers=len(data), errata=errata)
+    target_tickers = [target_ticker for target_ticker in target_tickers if target_ticker in data]
+    
+    # Convert dictionaries into DataFrames #
+    bal_sheet, inc_statement, cf_statement, fin_ratios = build_statements(data, target_tickers, 
+                                                                          modules)
+    
+    # Download DataFrames - see export_excel for Excel #
+    save_financials({'BS'    : bal_sheet, 
+                     'IS'    : inc_statement, 
+                     'CFS'   : cf_statement, 
+                     'RATIOS': fin_ratios}, exchange)
+    metrics.increment('rows_written', sum(len(fs) for fs in [bal_sheet, inc_statement, 
+                                                               cf_statement, fin_ratios]),
+                      stage='get_financials')
+    metrics.log('complete', stage='get_financials')
+    
+    return data, bal_sheet, inc_statement, cf_statement, fin_ratios
+
+
+def save_financials(statements, exchange='SGX'):
+    '''
+    Write financial statements to one Parquet file per statement, sorted by symbol,
+    period type and period end so that readers can skip unrelated row groups.
+    Parameters:
+        statements    : Dictionary of statement name (BS, IS, CFS, RATIOS) to DataFrame
+        exchange      : Short name for stock exchange. Default value is SGX
+    '''
+    for statement, fs in statements.items():
+        fs = normalise_statement(fs)
+        keys = [key for key in ['symbol', 'periodType', 'endDate'] if key in fs.columns]
+        if keys:
+            fs = fs.sort_values(keys, kind='mergesort')
+        filepath = get_financials_path(statement, exchange)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        fs.to_parquet(filepath, index=False, row_group_size=5000)
+
+
+def normalise_statement(fs):
+    '''
+    Returns the statement with one type per column, as required by Parquet. Period 
+    ends become dates, numeric columns become floats and anything else strings.
+    Parameter:
+        fs               : Target financial statement
+    Return:
+        fs               : Normalised financial statement
+    '''
+    fs = fs.copy()
+    if 'endDate' in fs.columns:
+        fs['endDate'] = pd.to_datetime(fs['endDate'], errors='coerce')
+    for column in fs.columns[fs.dtypes == object]:
+        values = fs[column]
+        numeric = pd.to_numeric(values, errors='coerce')
+        if numeric.notnull().sum() == values.notnull().sum():
+            fs[column] = numeric
+        else:
+            fs[column] = values.where(values.isnull(), values.astype(str))
+    
+    return fs
+
+
+def load_financials(statement='BS', symbols=None, period_type=None, start=None, end=None, 
+                    columns=None, exchange='SGX'):
+    '''
+    Read a financial statement, loading only the requested symbols and periods.
+    Parameters:
+        statement     : BS, IS, CFS or RATIOS. Default value is BS
+        symbols       : Ticker or list of tickers. Default value is None (all)
+        period_type   : 3M or 12M. Default value is None (both)
+        start         : Earliest period end (inclusive). Default value is None
+        end           : Latest period end (inclusive). Default value is None
+        columns       : List of line items to load. Default value is None (all)
+        exchange      : Short name for stock exchange. Default value is SGX
+    Return:
+        fs            : DataFrame indexed by symbol, period type and period end
+                        (symbol only for RATIOS)
+    '''
+    # Build row filters #
+    keys = ['symbol'] if statement == 'RATIOS' else ['symbol', 'periodType', 'endDate']
+    filters = []
+    if symbols is not None:
+        filters.append(('symbol', 'in', [symbols] if isinstance(symbols, str) else list(symbols)))
+    if period_type is not None and statement != 'RATIOS':
+        filters.append(('periodType', '=', period_type))
+    if start is not None and statement != 'RATIOS':
+        filters.append(('endDate', '>=', pd.Timestamp(start)))
+    if end is not None and statement != 'RATIOS':
+        filters.append(('endDate', '<=', pd.Timestamp(end)))
+    
+    # Load target columns only #
+    fs = pd.read_parquet(get_financials_path(statement, exchange),
+                         columns=None if columns is None else keys + list(columns),
+                         filters=filters or None)
+    
+    return fs.set_index(keys)
+
+
+def build_statements(data, target_tickers, modules):
+    '''
+    Convert YahooQuery modules into financial statements in a single pass. Rows are
+    collected per statement with their symbol and period type, and each DataFrame
+    is created once at the end.
+    Parameters:
+        data             : Dictionary of ticker to dictionary of modules
+        target_tickers   : List of tickers
+        modules          : List of YahooQuery modules
+    Return:
+        bal_sheet        : Balance sheets
+        inc_statement    : Income statements
+        cf_statement     : Cash flow statements
+        fin_ratios       : Financial ratios
+    '''
+    # Initialise parameters #
+    ## Statement and key holding its rows, per module ##
+    statement_keys = [('balanceSheetHistory', 'BS', 'balanceSheetStatements'),
+                      ('incomeStatementHistory', 'IS', 'incomeStatementHistory'),
+                      ('cashflowStatementHistory', 'CFS', 'cashflowStatements')]
+    ## Column builders per statement ##
+    records = {'BS'    : ColumnBuilder(['symbol', 'periodType']), 
+               'IS'    : ColumnBuilder(['symbol', 'periodType']),
+               'CFS'   : ColumnBuilder(['symbol', 'periodType']),
+               'RATIOS': ColumnBuilder(['symbol'])}
+    
+    # Collect records, tagging symbol and period type on insertion #
+    for target_ticker in target_tickers:
+        for module in modules:
+            try:
+                module_data = data[target_ticker][module]
+            except:
+                continue
+            for prefix, statement, key in statement_keys:
+                if re.search(prefix, module):
+                    period_type = '3M' if re.search(r'Quarterly', module) else '12M'
+                    try:
+                        rows = list(module_data[key])
+                    except:
+                        rows = []
+                    tags = {'symbol': target_ticker, 'periodType': period_type}
+                    for row in rows:
+                        records[statement].append(tag_record(row, tags))
+                    break
+            ## Financial Ratios - module is not a statement ##
+            else:
+                if isinstance(module_data, dict):
+                    records['RATIOS'].append(tag_record(module_data, {'symbol': target_ticker}))
+    
+    # Create each DataFrame once #
+    bal_sheet = records['BS'].to_frame()
+    inc_statement = records['IS'].to_frame()
+    cf_statement = records['CFS'].to_frame()
+    fin_ratios = records['RATIOS'].to_frame()
+    
+    return bal_sheet, inc_statement, cf_statement, fin_ratios
+
+
+class ColumnBuilder(object):
+    '''
+    Accumulate rows with varying keys column by column, so that no per-row 
+    dictionary is kept and the DataFrame is materialised once. Numeric columns 
+    are packed float64 arrays (None becomes NaN) and the DataFrame takes them 
+    without a copy. A column falls back to a list once a non-numeric value appears.
+    Parameter:
+        columns          : List of leading columns, kept as lists
+    '''
+    
+    def __init__(self, columns):
+        self.columns = {column: [] for column in columns}
+        self.rows = 0
+    
+    def append(self, record):
+        '''
+        Add one row. Columns seen for the first time are back-filled with NaN.
+        '''
+        for key, value in record.items():
+            values = self.columns.get(key)
+            if values is None:
+                values = self.columns[key] = [np.nan] * self.rows if isinstance(value, str) else \
+                                             array.array('d', [np.nan]) * self.rows
+            if type(values) is array.array:
+                try:
+                    values.append(np.nan if value is None else value)
+                    continue
+                except TypeError:
+                    values = self.columns[key] = values.tolist()
+            values.append(value)
+        self.rows += 1
+        for values in self.columns.values():
+            if len(values) < self.rows:
+                values.append(np.nan)
+    
+    def to_frame(self):
+        '''
+        Return the accumulated rows as a DataFrame.
+        '''
+        return pd.DataFrame({key: np.frombuffer(values, dtype=np.float64) if type(values) is array.array 
+                             else values for key, values in self.columns.items()}, copy=False)
+
+
+def tag_record(row, tags):
+    '''
+    Returns a copy of the row with the tags first, keeping non-null row values.
+    Parameters:
+        row              : Dictionary of one statement row
+        tags             : Dictionary of symbol and period type
+    Return:
+        record           : Tagged row
+    '''
+    record = dict(tags)
+    record.update(row)
+    for key, value in tags.items():
+        if pd.isnull(record[key]):
+            record[key] = value
+    
+    return record
+
+
+def get_period_type(fs, ticker, module):
+    '''
+    Returns the symbol and period type for the target financial statement.
+    Parameters:
+        fs               : Target financial statement
+        ticker           : Target ticker 
+        module           : Name of YahooQuery module
+    Return:
+        fs               : Updated financial statement
+    '''
+    # Fill up symbol #
+    fs.loc[fs['symbol'].isnull(), 'symbol'] = ticker
+    
+    # Fill up period type #
+    if not re.search(r'Quarterly', module):
+        fs.loc[fs['periodType'].isnull(), 'periodType'] = '12M'
+    else:
+        fs.loc[fs['periodType'].isnull(), 'periodType'] = '3M'
+
+    return fs
+
+######################################################################################################################################
+''' 
+##########          ########## 
+         MISCELLANEOUS 
+##########          ##########  
+'''
+
+def clean_responses(response, soup=None):
+    '''
+    Clear all the the responses to free up memory 
+    Parameters:
+        response      : Response from GET requests
+        soup          : Parsed BeautifulSoup     
+    '''
+    # Close response #
+    response.close()
+    response = None
+    
+    # Decompose soup if soup is valid #
+    if soup is not None:
+        soup.decompose()
+        
+    # Clear all the waste #
+    gc.collect()
+    
+
+def get_working_day():
+    '''
+    Returns the previous SGX trading session if today is not a trading session,
+    skipping weekends and exchange holidays (see TradingCalendar).
+    Return:
+        working_day   : Previous working day in datetime format
+    '''
+    # Latest session on or before today #
+    today = dt.datetime.now().date()
+    working_day = get_trading_calendar().previous_session(today, inclusive=True).astype(dt.date)
+    
+    return working_day
+
+def set_data_path(path=None):
+    '''
+    Set the local data folder used by every function of this module.
+    Parameter:
+        path          : Data folder. Default value is the SGX_DATA_PATH environment 
+                        variable, or Dropbox/Personal/Trading under the home folder
+    '''
+    global data_path, price_path, response_cache
+    if path is None:
+        path = os.environ.get('SGX_DATA_PATH', 
+                              os.path.join(os.path.expanduser('~'), 'Dropbox', 'Personal', 'Trading'))
+    data_path = path
+    price_path = os.path.join(data_path, 'Historical', 'SGX', 'Prices')
+    ## Response cache lives under the data folder ##
+    response_cache = None
+
+
+def set_api_urls(yahoo_url=None, wtd_url=None):
+    '''
+    Send YahooQuery and World Trading Data requests to other hosts, e.g. the stub 
+    server of run_benchmarks (see serve_fixtures).
+    Parameters:
+        yahoo_url     : Base URL replacing Yahoo Finance's query1 and query2 hosts.
+                        Default value is None (Yahoo Finance)
+        wtd_url       : Base URL replacing World Trading Data's API host.
+                        Default value is None (World Trading Data)
+    '''
+    global api_urls
+    api_urls = {'yahoo': yahoo_url,
+                'wtd'  : 'https://api.worldtradingdata.com' if wtd_url is None else wtd_url}
+
+
+class RedirectSession(requests.Session):
+    '''
+    requests.Session sending Yahoo Finance requests to another base URL, so that 
+    YahooQuery can be pointed at a stub server.
+    Parameter:
+        base_url      : Base URL replacing Yahoo Finance's hosts
+    '''
+    HOSTS = ['https://query1.finance.yahoo.com', 'https://query2.finance.yahoo.com']
+    
+    def __init__(self, base_url):
+        super(RedirectSession, self).__init__()
+        self.base_url = base_url.rstrip('/')
+    
+    def request(self, method, url, *args, **kwargs):
+        for host in self.HOSTS:
+            if url.startswith(host):
+                url = self.base_url + url[len(host):]
+                break
+        
+        return super(RedirectSession, self).request(method, url, *args, **kwargs)
+
+
+def get_yahoo_ticker(symbols):
+    '''
+    Return a YahooQuery Ticker, sending its requests to the base URL set by 
+    set_api_urls if any.
+    '''
+    from yahooquery import Ticker
+    
+    if api_urls['yahoo'] is None:
+        return Ticker(symbols)
+    
+    return Ticker(symbols, session=RedirectSession(api_urls['yahoo']))
+
+
+def get_tickers_path(exchange='SGX'):
+    '''
+    Return the filename (incl path) of the exchange's tickers.
+    Parameter:
+        exchange      : Short name for stock exchange. Default value is SGX
+    '''
+    return os.path.join(data_path, 'Historical', '%s_TICKERS.parquet' % exchange.upper())
+
+
+def get_financials_path(statement='BS', exchange='SGX'):
+    '''
+    Return the filename (incl path) of one of the exchange's financial statements.
+    Parameters:
+        statement     : BS, IS, CFS or RATIOS. Default value is BS
+        exchange      : Short name for stock exchange. Default value is SGX
+    '''
+    return os.path.join(data_path, 'Historical', exchange, 'Financials', '%s.parquet' % statement)
+
+
+def read_table(filepath):
+    '''
+    Read a Parquet table. The legacy Excel file of the same name is converted 
+    to Parquet on first use. Excel and Feather files can also be read directly.
+    Parameter:
+        filepath      : Filename (incl path) of the table
+    Return:
+        df            : DataFrame
+    '''
+    # Convert legacy Excel file #
+    legacy_path = os.path.splitext(filepath)[0] + '.xlsx'
+    if filepath.endswith('.parquet') and not os.path.exists(filepath) and os.path.exists(legacy_path):
+        pd.read_excel(legacy_path).to_parquet(filepath, index=False)
+    
+    # Read by file extension #
+    if filepath.endswith('.xlsx'):
+        return pd.read_excel(filepath)
+    elif filepath.endswith('.feather'):
+        return pd.read_feather(filepath)
+    
+    return pd.read_parquet(filepath)
+
+
+def export_excel(exchange='SGX', path=None):
+    '''
+    Export the exchange's tickers and financial statements to the Excel workbooks
+    SGX_TICKERS.xlsx and FIN_STATEMENTS.xlsx.
+    Parameters:
+        exchange      : Short name for stock exchange. Default value is SGX
+        path          : Folder for the workbooks. Default value is the Historical folders
+    Return:
+        filepaths     : List of workbooks written
+    '''
+    filepaths = []
+    if path is not None:
+        os.makedirs(path, exist_ok=True)
+    
+    # Tickers #
+    if os.path.exists(get_tickers_path(exchange)):
+        filepath = os.path.join(path or os.path.dirname(get_tickers_path(exchange)), 
+                                '%s_TICKERS.xlsx' % exchange.upper())
+        read_table(get_tickers_path(exchange)).to_excel(filepath, sheet_name='TICKERS', index=False)
+        filepaths.append(filepath)
+    
+    # Financial statements #
+    statements = [statement for statement in ['BS', 'IS', 'CFS', 'RATIOS'] 
+                  if os.path.exists(get_financials_path(statement, exchange))]
+    if statements:
+        filepath = os.path.join(path or os.path.join(data_path, 'Historical', exchange),
+                                'FIN_STATEMENTS.xlsx')
+        with pd.ExcelWriter(filepath, engine='xlsxwriter') as writer:
+            for statement in statements:
+                fs = pd.read_parquet(get_financials_path(statement, exchange))
+                fs.to_excel(writer, sheet_name=statement, index=False)
+        filepaths.append(filepath)
+    
+    return filepaths
+
+
+def fetch_batches(fetch, target_tickers, batch_size=50, max_workers=4, retries=3, backoff=1.0,
+                  stage='fetch_batches'):
+    '''
+    Run a fetch function over the universe in concurrent batches (see fetch_batch).
+    Parameters:
+        fetch          : Function taking a list of tickers and returning a dictionary
+                         of ticker to data for the tickers that succeeded
+        target_tickers : List of tickers
+        batch_size     : Number of tickers per batch. Default value is 50
+        max_workers    : Number of concurrent batches. Default value is 4
+        retries        : Number of retries per batch. Default value is 3
+        backoff        : Seconds to wait before the first retry, doubled on every
+                         further retry. Default value is 1 second
+        stage          : Stage name for request, retry and failure metrics. 
+                         Default value is fetch_batches
+    Return:
+        results        : Dictionary of ticker to data
+        errata         : List of tickers that failed after all retries
+        timings        : DataFrame of wall time, attempts and failures per batch
+    '''
+    # Split the universe into batches #
+    batches = [target_tickers[i:i+batch_size] for i in range(0, len(target_tickers), batch_size)]
+    
+    # Run batches on a bounded thread pool #
+    results, errata, timings = {}, [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch_batch, fetch, batch_num, batch, retries, backoff, stage) 
+                   for batch_num, batch in enumerate(batches)]
+        for future in as_completed(futures):
+            batch_results, batch_errata, timing = future.result()
+            results.update(batch_results)
+            errata += batch_errata
+            timings.append(timing)
+    timings = pd.DataFrame(timings, columns=['BATCH', 'TICKERS', 'SECONDS', 'ATTEMPTS', 'FAILED'])
+    timings = timings.sort_values('BATCH').reset_index(drop=True)
+    
+    return results, errata, timings
+
+
+def fetch_batch(fetch, batch_num, batch, retries=3, backoff=1.0, stage='fetch_batches'):
+    '''
+    Fetch one batch of tickers. A batch that raises is narrowed down to one request 
+    per ticker so that one bad symbol does not fail the whole batch, and only the 
+    tickers that failed are retried, with exponential backoff.
+    Parameters:
+        fetch          : Function taking a list of tickers and returning a dictionary
+                         of ticker to data for the tickers that succeeded
+        batch_num      : Number of the batch
+        batch          : List of tickers
+        retries        : Number of retries. Default value is 3
+        backoff        : Seconds to wait before the first retry, doubled on every
+                         further retry. Default value is 1 second
+        stage          : Stage name for request, retry and failure metrics. 
+                         Default value is fetch_batches
+    Return:
+        results        : Dictionary of ticker to data
+        pending        : List of tickers that failed after all retries
+        timing         : Dictionary of wall time, attempts and failures
+    '''
+    # Initialise parameters #
+    results = {}
+    pending = list(batch)
+    attempt = 0
+    start_time = time.time()
+    
+    # Retry the tickers still pending #
+    while pending and attempt <= retries:
+        if attempt:
+            time.sleep(backoff * 2**(attempt-1))
+            metrics.increment('retries', stage=stage)
+        try:
+            metrics.increment('requests', stage=stage)
+            results.update(fetch(pending))
+        except Exception:
+            ## Isolate failures to individual tickers ##
+            for ticker in pending:
+                try:
+                    metrics.increment('requests', stage=stage)
+                    results.update(fetch([ticker]))
+                except Exception:
+                    pass
+        pending = [ticker for ticker in pending if ticker not in results]
+        attempt += 1
+    
+    timing = {'BATCH'   : batch_num,
+              'TICKERS' : len(batch),
+              'SECONDS' : time.time() - start_time,
+              'ATTEMPTS': attempt,
+              'FAILED'  : len(pending)}
+    metrics.log('batch', stage=stage, **timing)
+    for ticker in pending:
+        metrics.failure(stage, ticker, 'no data after %d attempts' % attempt)
+    
+    return results, pending, timing
+
+
+def fetch_history(batch, **kwargs):
+    '''
+    Fetch function for fetch_batches returning each ticker's historical prices.
+    Parameters:
+        batch         : List of tickers
+        kwargs        : Keyword arguments of Ticker.history
+    Return:
+        results       : Dictionary of ticker to DataFrame of prices
+    '''
+    historical = get_yahoo_ticker(batch).history(**kwargs)
+    results = {}
+    for ticker in batch:
+        try:
+            results[ticker] = split_history(historical, ticker)
+        except:
+            pass
+    
+    return results
+
+
+def fetch_modules(batch, modules, cache=None):
+    '''
+    Fetch function for fetch_batches returning each ticker's YahooQuery modules.
+    Modules still fresh in the response cache are not requested again. Tickers 
+    Yahoo answers with an error message (no data) are returned empty, and their 
+    uncached modules are cached as empty so they are not requested again until 
+    the module TTL expires.
+    Parameters:
+        batch         : List of tickers
+        modules       : List of YahooQuery modules
+        cache         : ResponseCache to use. Default value is None (no caching)
+    Return:
+        results       : Dictionary of ticker to dictionary of modules
+    '''
+    # Request every module without a cache #
+    if cache is None:
+        data = get_yahoo_ticker(batch).get_modules(modules)
+        ## Tickers without data are returned as error messages ##
+        return {ticker: value if isinstance(value, dict) else {} for ticker, value in data.items()}
+    
+    # Serve fresh modules from the cache - modules a ticker lacks are cached as None #
+    results, stale = {}, {}
+    entries = cache.get_many('get_modules', batch, modules)
+    for ticker in batch:
+        cached = {module: entries.get((ticker, module)) for module in modules}
+        if any(entry is not None for entry in cached.values()):
+            results[ticker] = {module: entry['payload'] for module, entry in cached.items() 
+                               if entry is not None and entry['fresh']}
+        missing = [module for module in modules if module not in results.get(ticker, {})]
+        if missing and not cache.offline:
+            stale[ticker] = missing
+        metrics.increment('cache_hit', len(modules) - len(missing), stage='get_financials')
+        metrics.increment('cache_miss', len(missing), stage='get_financials')
+    
+    # Request stale modules only #
+    if stale:
+        stale_modules = [module for module in modules 
+                         if any(module in missing for missing in stale.values())]
+        data = get_yahoo_ticker(list(stale)).get_modules(stale_modules)
+        fetched = []
+        for ticker, missing in stale.items():
+            value = data.get(ticker)
+            ## Tickers without data are returned as error messages - keep their fresh modules ##
+            if not isinstance(value, dict):
+                fetched.extend({'endpoint': 'get_modules', 'symbol': ticker, 'module': module, 
+                                'payload': None}
+                               for module in missing if (ticker, module) not in entries)
+                results.setdefault(ticker, {})
+                continue
+            for module in missing:
+                fetched.append({'endpoint': 'get_modules', 'symbol': ticker, 'module': module, 
+                                'payload': value.get(module)})
+                results.setdefault(ticker, {})[module] = value.get(module)
+        cache.put_many(fetched)
+    
+    return {ticker: {module: payload for module, payload in value.items() if payload is not None}
+            for ticker, value in results.items()}
+
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+       STREAMING PIPELINE 
+##########          ##########  
+'''
+
+class Pipeline(object):
+    '''
+    Producer/consumer pipeline. Items flow through stages connected by bounded
+    queues and each stage runs on its own worker threads, so downloading, parsing
+    and writing overlap. A full queue blocks the stage feeding it (backpressure),
+    so only about (workers + queue_size) items per stage are in flight whatever 
+    the number of items. Wall time, busy time, time blocked on the next stage and
+    records processed are measured per stage.
+    Parameters:
+        stages        : List of (name, function, workers). Each function takes an item
+                        and returns the item for the next stage, or None to drop it
+        queue_size    : Capacity of each queue between stages. Default value is 2
+        count         : Function returning the number of records in a stage's output.
+                        Default value is len
+        name          : Name of the pipeline in metrics. Default value is pipeline
+    '''
+    
+    def __init__(self, stages, queue_size=2, count=len, name='pipeline'):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.count = count
+        self.name = name
+        self.stats = OrderedDict((stage, {'ITEMS': 0, 'RECORDS': 0, 'WALL_SECONDS': 0.0, 
+                                          'BUSY_SECONDS': 0.0, 'BLOCKED_SECONDS': 0.0}) 
+                                 for stage, function, workers in stages)
+        self.lock = threading.Lock()
+    
+    def run(self, items):
+        '''
+        Stream the items through every stage and wait until all are processed.
+        Parameter:
+            items         : Iterable of items for the first stage (not None)
+        Return:
+            throughput    : DataFrame of records per second and timings per stage 
+                            (see get_throughput)
+        '''
+        # Initialise queues and per-run statistics #
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        running = [workers for stage, function, workers in self.stages]
+        stats = {stage: dict.fromkeys(stat, 0) for stage, stat in self.stats.items()}
+        start_time = time.time()
+        
+        def work(i):
+            stage, function, workers = self.stages[i]
+            while True:
+                item = queues[i].get()
+                if item is None:
+                    break
+                ## Process item ##
+                busy_time = time.time()
+                try:
+                    output = function(item)
+                except Exception as e:
+                    metrics.failure('%s.%s' % (self.name, stage), None, e)
+                    output = None
+                ## Hand over to the next stage - blocks while it is full ##
+                blocked_time = time.time()
+                if output is not None and i + 1 < len(self.stages):
+                    queues[i+1].put(output)
+                with self.lock:
+                    stats[stage]['ITEMS'] += 1
+                    stats[stage]['RECORDS'] += 0 if output is None else self.count(output)
+                    stats[stage]['BUSY_SECONDS'] += blocked_time - busy_time
+                    stats[stage]['BLOCKED_SECONDS'] += time.time() - blocked_time
+            # Last worker of the stage closes the next stage #
+            with self.lock:
+                running[i] -= 1
+                closing = running[i] == 0
+                if closing:
+                    stats[stage]['WALL_SECONDS'] = time.time() - start_time
+            if closing and i + 1 < len(self.stages):
+                for _ in range(self.stages[i+1][2]):
+                    queues[i+1].put(None)
+        
+        # Start workers of every stage #
+        threads = [threading.Thread(target=work, args=(i,), daemon=True)
+                   for i, (stage, function, workers) in enumerate(self.stages) 
+                   for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        
+        # Feed the first stage - blocks while it is busy #
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0][2]):
+                queues[0].put(None)
+            for thread in threads:
+                thread.join()
+        
+        # Accumulate statistics #
+        for stage, stat in stats.items():
+            for key, value in stat.items():
+                self.stats[stage][key] += value
+            metrics.increment('records', stat['RECORDS'], stage='%s.%s' % (self.name, stage))
+            metrics.increment('busy_seconds', stat['BUSY_SECONDS'], stage='%s.%s' % (self.name, stage))
+            metrics.increment('blocked_seconds', stat['BLOCKED_SECONDS'], 
+                              stage='%s.%s' % (self.name, stage))
+            metrics.log('throughput', stage='%s.%s' % (self.name, stage), **stat)
+        
+        return self.get_throughput()
+    
+    def get_throughput(self):
+        '''
+        Return the statistics of all runs so far as a DataFrame per stage.
+        '''
+        throughput = pd.DataFrame.from_dict(self.stats, orient='index')
+        throughput['RECORDS_PER_SECOND'] = throughput['RECORDS']/throughput['WALL_SECONDS']
+        throughput.index.name = 'STAGE'
+        
+        return throughput
+
+
+def make_history_pipeline(write, max_workers=4, parse_workers=2, writers=1, queue_size=2, 
+                          retries=3, stage='get_historical'):
+    '''
+    Return a Pipeline that downloads historical prices batch by batch, normalises
+    each ticker's prices and hands them to a writer, so that only a few batches 
+    are held in memory at any time.
+    Parameters:
+        write         : Function taking (history parameters, ticker, DataFrame) that 
+                        stores one ticker's prices
+        max_workers   : Number of concurrent downloads. Default value is 4
+        parse_workers : Number of normalising threads. Default value is 2
+        writers       : Number of writing threads. Default value is 1
+        queue_size    : Number of batches waiting between stages. Default value is 2
+        retries       : Number of retries per batch. Default value is 3
+        stage         : Stage name for metrics. Default value is get_historical
+    Return:
+        pipeline      : Pipeline taking (batch number, tickers, Ticker.history parameters)
+        timings       : List of batch timings, filled in as batches are downloaded
+    '''
+    timings = []
+    
+    def fetch(item):
+        batch_num, batch, params = item
+        results, pending, timing = fetch_batch(lambda tickers: fetch_history(tickers, **params),
+                                               batch_num, batch, retries=retries, stage=stage)
+        timings.append(timing)
+        return params, results
+    
+    def parse(item):
+        params, results = item
+        targets = []
+        for ticker, target in results.items():
+            target = target[~target.index.duplicated(keep='last')].sort_index()
+            if params.get('interval', '1d') != '1d':
+                target = target.dropna()
+            if len(target):
+                targets.append((ticker, target))
+        return params, targets
+    
+    def store(item):
+        params, targets = item
+        for ticker, target in targets:
+            try:
+                write(params, ticker, target)
+            except Exception as e:
+                metrics.failure(stage, ticker, e)
+        return params, [ticker for ticker, target in targets]
+    
+    pipeline = Pipeline([('fetch', fetch, max_workers), ('parse', parse, parse_workers), 
+                         ('write', store, writers)],
+                        queue_size=queue_size, count=lambda item: len(item[1]), name=stage)
+    
+    return pipeline, timings
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+       TRADING CALENDAR 
+##########          ##########  
+'''
+
+## SGX full-day market closures on weekdays (public holidays incl. observed days) ##
+SGX_HOLIDAYS = [
+    '2018-01-01', '2018-02-16', '2018-03-30', '2018-05-01', '2018-05-29', '2018-06-15',
+    '2018-08-09', '2018-08-22', '2018-11-06', '2018-12-25',
+    '2019-01-01', '2019-02-05', '2019-02-06', '2019-04-19', '2019-05-01', '2019-05-20', 
+    '2019-06-05', '2019-08-09', '2019-08-12', '2019-10-28', '2019-12-25',
+    '2020-01-01', '2020-01-27', '2020-04-10', '2020-05-01', '2020-05-07', '2020-05-25', 
+    '2020-07-10', '2020-07-31', '2020-08-10', '2020-12-25',
+    '2021-01-01', '2021-02-12', '2021-04-02', '2021-05-13', '2021-05-26', '2021-07-20',
+    '2021-08-09', '2021-11-04',
+    '2022-02-01', '2022-02-02', '2022-04-15', '2022-05-02', '2022-05-03', '2022-05-16', 
+    '2022-07-11', '2022-08-09', '2022-10-24', '2022-12-26',
+    '2023-01-02', '2023-01-23', '2023-01-24', '2023-04-07', '2023-05-01', '2023-06-02', 
+    '2023-06-29', '2023-08-09', '2023-09-01', '2023-11-13', '2023-12-25',
+    '2024-01-01', '2024-02-12', '2024-03-29', '2024-04-10', '2024-05-01', '2024-05-22', 
+    '2024-06-17', '2024-08-09', '2024-10-31', '2024-12-25',
+    '2025-01-01', '2025-01-29', '2025-01-30', '2025-03-31', '2025-04-18', '2025-05-01', 
+    '2025-05-12', '2025-08-18', '2025-10-20', '2025-12-25',
+    '2026-01-01', '2026-02-17', '2026-02-18', '2026-04-03', '2026-05-01', '2026-05-27', 
+    '2026-06-01', '2026-08-10', '2026-11-09', '2026-12-25',
+    '2027-01-01', '2027-02-08', '2027-03-10', '2027-03-26', '2027-05-17', '2027-05-20', 
+    '2027-08-09', '2027-10-28',
+    ]
+## SGX half-day sessions - eves of Chinese New Year, Christmas and New Year ##
+SGX_CNY_EVES = ['2018-02-15', '2019-02-04', '2020-01-24', '2021-02-11', '2022-01-31', 
+                '2024-02-09', '2025-01-28', '2026-02-16', '2027-02-05']
+
+
+class TradingCalendar(object):
+    '''
+    Precomputed trading sessions with O(1) vectorized lookups. Every calendar day
+    in range is mapped to the position of the latest session on or before it, so
+    "previous session", "N sessions back" and "sessions between" are array lookups.
+    Outside the years covered by the holiday list only weekends are excluded, and a
+    warning is logged the first time a date after the last covered year is looked up.
+    Parameters:
+        holidays      : List of weekday market closures. Default value is SGX_HOLIDAYS
+        half_days     : List of half-day sessions. Default value is SGX's eves of 
+                        Chinese New Year, Christmas and New Year
+        start         : First calendar day. Default value is 1990-01-01
+        end           : Last calendar day. Default value is 2035-12-31
+    '''
+    
+    def __init__(self, holidays=None, half_days=None, start='1990-01-01', end='2035-12-31'):
+        # Initialise parameters #
+        holidays = np.array(SGX_HOLIDAYS if holidays is None else holidays, dtype='datetime64[D]')
+        self.start = np.datetime64(start, 'D')
+        self.days = np.arange(self.start, np.datetime64(end, 'D') + 1)
+        
+        # Sessions are weekdays that are not holidays #
+        weekday = (self.days.astype(np.int64) + 3) % 7
+        is_session = (weekday < 5) & ~np.isin(self.days, holidays)
+        self.sessions = self.days[is_session]
+        self.session_position = np.cumsum(is_session) - 1
+        
+        # Half days #
+        if half_days is None:
+            years = np.arange(self.days[0].astype('datetime64[Y]').astype(int) + 1970,
+                              self.days[-1].astype('datetime64[Y]').astype(int) + 1971)
+            half_days = SGX_CNY_EVES + ['%d-12-24' % year for year in years] + \
+                        ['%d-12-31' % year for year in years]
+        half_days = np.array(half_days, dtype='datetime64[D]')
+        self.half_days = np.intersect1d(self.sessions, half_days)
+        
+        # Last day covered by the holiday list #
+        self.covered_end = (holidays.max().astype('datetime64[Y]') + 1).astype('datetime64[D]') - 1 \
+                           if len(holidays) else None
+        self.warned = False
+        
+        # Average sessions per year over the years covered by the holiday list #
+        covered = holidays.astype('datetime64[Y]')
+        session_years = self.sessions.astype('datetime64[Y]')
+        if len(covered):
+            counts = [np.count_nonzero(session_years == year) for year in np.unique(covered)]
+            self.annual_sessions = float(np.mean(counts))
+        else:
+            self.annual_sessions = 252.0
+    
+    def get_position(self, dates):
+        '''
+        Return the position of each date's day in the calendar.
+        '''
+        offset = (np.asarray(dates, dtype='datetime64[D]') - self.start).astype(np.int64)
+        if np.any((offset < 0) | (offset >= len(self.days))):
+            raise ValueError('Dates outside trading calendar (%s to %s)' % (self.days[0], self.days[-1]))
+        if not self.warned and self.covered_end is not None and \
+           np.any(offset > (self.covered_end - self.start).astype(np.int64)):
+            self.warned = True
+            logging.getLogger('TA_SGX').warning('Holidays are only listed up to %s - later dates only '
+                                                'exclude weekends' % self.covered_end)
+        
+        return offset
+    
+    def previous_session(self, dates, inclusive=False):
+        '''
+        Return the latest session before each date (on or before if inclusive).
+        '''
+        position = self.get_position(dates) - (0 if inclusive else 1)
+        
+        return self.sessions[self.session_position[position]]
+    
+    def sessions_back(self, dates, n):
+        '''
+        Return the session n sessions before the latest session on or before each date.
+        '''
+        return self.sessions[self.session_position[self.get_position(dates)] - n]
+    
+    def sessions_between(self, start, end):
+        '''
+        Return the number of sessions after start and up to end (inclusive).
+        '''
+        return (self.session_position[self.get_position(end)] - 
+                self.session_position[self.get_position(start)])
+    
+    def get_sessions(self, start, end):
+        '''
+        Return the array of sessions from start to end (inclusive).
+        '''
+        return self.sessions[(self.sessions >= np.datetime64(start, 'D')) & 
+                             (self.sessions <= np.datetime64(end, 'D'))]
+    
+    def is_half_day(self, dates):
+        '''
+        Return whether each date is a half-day session.
+        '''
+        return np.isin(np.asarray(dates, dtype='datetime64[D]'), self.half_days)
+
+
+def get_trading_calendar():
+    '''
+    Return the shared SGX TradingCalendar, creating it on first use.
+    '''
+    global trading_calendar
+    if trading_calendar is None:
+        trading_calendar = TradingCalendar()
+    
+    return trading_calendar
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+        INDICATOR CACHE 
+##########          ##########  
+'''
+
+class IndicatorCache(object):
+    '''
+    Least-recently-used cache of indicator arrays keyed by (ticker, indicator, 
+    parameters, last data timestamp, number of bars). Appending bars changes the 
+    key; restated history must be dropped with invalidate(), as PriceStore.write 
+    does. When the memory budget is exceeded the oldest entries are evicted, or 
+    spilled to disk if spill_path is set. Spilled files only live as long as the 
+    cache - leftovers of earlier runs are removed on creation.
+    Parameters:
+        max_bytes     : Memory budget for cached arrays. Default value is 256MB
+        spill_path    : Directory for evicted entries. Default value is None (discard)
+    '''
+    
+    def __init__(self, max_bytes=256e6, spill_path=None):
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.spilled = {}
+        
+        # Remove spilled files of earlier runs #
+        if spill_path is not None and os.path.isdir(spill_path):
+            for filename in os.listdir(spill_path):
+                if re.fullmatch(r'[0-9a-f]{32}_[0-9a-f]{32}\.npz', filename):
+                    os.remove(os.path.join(spill_path, filename))
+    
+    def get_spill_file(self, key):
+        '''
+        Return the filename (incl path) of a spilled entry.
+        '''
+        series = hashlib.md5(repr(key[:3]).encode()).hexdigest()
+        return os.path.join(self.spill_path, series + '_' + hashlib.md5(repr(key).encode()).hexdigest() + '.npz')
+    
+    def drop_spilled(self, series, keep=None):
+        '''
+        Delete the spilled file of a series (ticker, indicator, parameters) unless 
+        it holds the key to keep. The caller must hold the lock.
+        '''
+        key = self.spilled.get(series)
+        if key is not None and key != keep:
+            del self.spilled[series]
+            try:
+                os.remove(self.get_spill_file(key))
+            except FileNotFoundError:
+                pass
+    
+    def get(self, key):
+        '''
+        Return the cached arrays for the key or None.
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            spilled = self.spilled.get(key[:3]) == key
+        
+        # Reload spilled entry #
+        if spilled:
+            with np.load(self.get_spill_file(key)) as spilled:
+                value = tuple(spilled['arr_%d' % i] for i in range(len(spilled.files)))
+            self.put(key, value)
+            self.hits += 1
+            return value
+        self.misses += 1
+        
+        return None
+    
+    def put(self, key, value):
+        '''
+        Cache a tuple of arrays, dropping older versions of the same series and
+        evicting least-recently-used entries beyond the memory budget.
+        '''
+        with self.lock:
+            ## Drop entries of the same series computed on older data ##
+            for stale in [k for k in self.entries if k[:3] == key[:3] and k != key]:
+                self.nbytes -= sum(array.nbytes for array in self.entries.pop(stale))
+            self.drop_spilled(key[:3], keep=key)
+            if key not in self.entries:
+                self.nbytes += sum(array.nbytes for array in value)
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            ## Evict least-recently-used entries ##
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                old_key, old_value = self.entries.popitem(last=False)
+                self.nbytes -= sum(array.nbytes for array in old_value)
+                if self.spill_path is not None:
+                    os.makedirs(self.spill_path, exist_ok=True)
+                    self.drop_spilled(old_key[:3], keep=old_key)
+                    np.savez(self.get_spill_file(old_key), *old_value)
+                    self.spilled[old_key[:3]] = old_key
+    
+    def invalidate(self, ticker):
+        '''
+        Drop all entries of a ticker, in memory and spilled, e.g. after its price 
+        history was restated.
+        '''
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == ticker]:
+                self.nbytes -= sum(array.nbytes for array in self.entries.pop(key))
+            for series in [s for s in self.spilled if s[0] == ticker]:
+                self.drop_spilled(series)
+    
+    def clear(self):
+        '''
+        Drop all entries held in memory.
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+def get_indicator_cache():
+    '''
+    Return the shared IndicatorCache, creating it on first use.
+    '''
+    global indicator_cache
+    if indicator_cache is None:
+        indicator_cache = IndicatorCache()
+    
+    return indicator_cache
+
+
+@functools.lru_cache(maxsize=None)
+def get_indicator_inputs(indicator):
+    '''
+    Return the names of the price series a TA-Lib function takes, e.g. 
+    ('high', 'low') for SAR.
+    '''
+    from talib import abstract
+    
+    names = []
+    for value in abstract.Function(indicator).input_names.values():
+        names += value if isinstance(value, list) else [value]
+    
+    return tuple(names)
+
+
+def compute_indicator(indicator, high, low, close, params, ticker=None, timestamp=None, cache=None):
+    '''
+    Calculate a TA-Lib indicator, reusing the cached result when the same ticker,
+    parameters and data (last timestamp and number of bars) were seen before.
+    Parameters:
+        indicator     : TA-Lib function name on high, low and/or close, e.g. SAR, STOCHF 
+                        or STOCH
+        high          : 1D array of high prices
+        low           : 1D array of low prices
+        close         : 1D array of closing prices
+        params        : Dictionary of indicator parameters
+        ticker        : Ticker of the prices. Default value is None (no caching)
+        timestamp     : Timestamp of the last bar. Default value is None (no caching)
+        cache         : IndicatorCache to use. Default value is the shared cache
+    Return:
+        outputs       : Tuple of indicator arrays
+    '''
+    import talib as ta
+    
+    # Calculate without caching if the data cannot be identified - TA-Lib needs float64 #
+    prices = {'high': high, 'low': low, 'close': close}
+    inputs = tuple(np.asarray(prices[name], dtype=np.float64) for name in get_indicator_inputs(indicator))
+    if ticker is None or timestamp is None:
+        outputs = getattr(ta, indicator)(*inputs, **params)
+        return outputs if isinstance(outputs, tuple) else (outputs,)
+    
+    # Look up cache #
+    if cache is None:
+        cache = get_indicator_cache()
+    key = (ticker, indicator, tuple(sorted(params.items())), str(pd.Timestamp(timestamp)), len(close))
+    outputs = cache.get(key)
+    if outputs is None:
+        outputs = getattr(ta, indicator)(*inputs, **params)
+        outputs = outputs if isinstance(outputs, tuple) else (outputs,)
+        cache.put(key, outputs)
+    
+    return outputs
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+       STRATEGY REGISTRY 
+##########          ##########  
+'''
+
+## Comparison operators allowed in strategy rules ##
+RULE_OPERATORS = OrderedDict([('<=', np.less_equal), ('>=', np.greater_equal), ('==', np.equal), 
+                              ('!=', np.not_equal), ('<', np.less), ('>', np.greater)])
+
+
+def parse_rule(rule):
+    '''
+    Return a rule as a list of (operand, operator, operand) conditions that must all
+    hold. Operands are array names or numbers and operators are keys of RULE_OPERATORS.
+    Parameter:
+        rule          : List of conditions, or a string of conditions joined by &, 
+                        e.g. '(sar < close) & (fastk > 20)'
+    Return:
+        conditions    : List of (operand, operator, operand)
+    '''
+    if isinstance(rule, str):
+        pattern = r'^\s*\(?\s*([\w.+-]+)\s*(%s)\s*([\w.+-]+)\s*\)?\s*$' % \
+                  '|'.join(re.escape(op) for op in RULE_OPERATORS)
+        conditions = []
+        for condition in rule.split('&'):
+            match = re.match(pattern, condition)
+            if match is None:
+                raise ValueError('Invalid condition %r in rule %r' % (condition.strip(), rule))
+            conditions.append(match.groups())
+        rule = conditions
+    
+    # Numbers become floats, anything else must be an array name #
+    conditions = []
+    for left, op, right in rule:
+        if op not in RULE_OPERATORS:
+            raise ValueError('Unknown operator %r - use one of %s' % (op, list(RULE_OPERATORS)))
+        operands = []
+        for operand in (left, right):
+            if isinstance(operand, str) and not re.match(r'^[A-Za-z_]\w*$', operand):
+                operand = float(operand)
+            operands.append(operand)
+        conditions.append((operands[0], op, operands[1]))
+    
+    return conditions
+
+
+class Strategy(object):
+    '''
+    Trading strategy declared as buy and sell rules over named indicator arrays.
+    Rules are comparisons joined by &, e.g. '(sar < close) & (fastk > slowk)' (see 
+    parse_rule), or module-level functions taking the dictionary of arrays, so that
+    strategies pickle for worker processes. Rules are evaluated with RULE_OPERATORS 
+    on the whole (date x ticker) panel at once - no code is evaluated. The arrays 
+    are high, low and close plus the outputs of the strategy's indicators.
+    Parameters:
+        name          : Name of the strategy
+        indicators    : List of (TA-Lib function, parameters, output names), e.g.
+                        ('STOCHF', {'fastk_period': 5, ...}, ['fastk', 'fastd'])
+        buy           : Buy rule
+        sell          : Sell rule
+    '''
+    
+    def __init__(self, name, indicators, buy, sell):
+        self.name = name
+        self.indicators = [(function, dict(params), list(outputs)) 
+                           for function, params, outputs in indicators]
+        self.buy = buy if callable(buy) else parse_rule(buy)
+        self.sell = sell if callable(sell) else parse_rule(sell)
+    
+    def get_arrays(self):
+        '''
+        Return the names of the arrays available to the rules.
+        '''
+        return ['high', 'low', 'close'] + [output for function, params, outputs in self.indicators 
+                                           for output in outputs]
+    
+    def validate(self):
+        '''
+        Check that the rules only refer to available arrays and the indicators exist 
+        in TA-Lib. Raise ValueError otherwise.
+        '''
+        import talib as ta
+        
+        for function, params, outputs in self.indicators:
+            if not hasattr(ta, function):
+                raise ValueError('%s: unknown TA-Lib function %s' % (self.name, function))
+        arrays = self.get_arrays()
+        for rule in [self.buy, self.sell]:
+            if callable(rule):
+                continue
+            for condition in rule:
+                for operand in condition[::2]:
+                    if isinstance(operand, str) and operand not in arrays:
+                        raise ValueError('%s: rule refers to %s, which is not one of %s' 
+                                         % (self.name, operand, arrays))
+    
+    def evaluate_rule(self, rule, arrays):
+        '''
+        Return the boolean array of a rule.
+        '''
+        if callable(rule):
+            return rule(arrays)
+        
+        result = np.ones(arrays['close'].shape, dtype=bool)
+        for left, op, right in rule:
+            left = arrays[left] if isinstance(left, str) else left
+            right = arrays[right] if isinstance(right, str) else right
+            result &= RULE_OPERATORS[op](left, right)
+        
+        return result
+    
+    def get_signals(self, arrays):
+        '''
+        Return the int8 signal matrix - 1 (buy), -1 (sell) and 0 (no signal).
+        '''
+        signal = np.zeros(arrays['close'].shape, dtype=np.int8)
+        signal[self.evaluate_rule(self.buy, arrays)] = 1
+        signal[self.evaluate_rule(self.sell, arrays)] = -1
+        
+        return signal
+
+
+def make_sar_stoch_strategy(acceleration=0.02, maximum=0.2, fastk_period=5, fastd_period=3,
+                            slowk_period=3, slowd_period=3, name='SAR_STOCH'):
+    '''
+    Return the Parabolic SAR and Stochastic Oscillator strategy (see test_strat).
+    Parameters:
+        acceleration  : SAR acceleration factor. Default value is 0.02
+        maximum       : SAR maximum acceleration factor. Default value is 0.2
+        fastk_period  : Stochastic %K lookback. Default value is 5
+        fastd_period  : Fast stochastic %D period. Default value is 3
+        slowk_period  : Slow stochastic %K period. Default value is 3
+        slowd_period  : Slow stochastic %D period. Default value is 3
+        name          : Name of the strategy. Default value is SAR_STOCH
+    Return:
+        strategy      : Strategy
+    '''
+    return Strategy(name, 
+                    [('SAR', {'acceleration': acceleration, 'maximum': maximum}, ['sar']),
+                     ('STOCHF', {'fastk_period': fastk_period, 'fastd_period': fastd_period, 
+                                 'fastd_matype': 0}, ['fastk', 'fastd']),
+                     ('STOCH', {'fastk_period': fastk_period, 'slowk_period': slowk_period, 
+                                'slowk_matype': 0, 'slowd_period': slowd_period, 
+                                'slowd_matype': 0}, ['slowk', 'slowd'])],
+                    buy='(sar < close) & (fastd > slowd) & (fastk > slowk)',
+                    sell='(sar > close) & (fastd < slowd) & (fastk < slowk)')
+
+
+def register_strategy(strategy):
+    '''
+    Add a strategy to the shared registry, replacing any strategy of the same name.
+    Raise ValueError if its rules refer to unknown arrays or indicators.
+    '''
+    if not isinstance(strategy, Strategy):
+        raise TypeError('Expected a Strategy, got %r' % type(strategy).__name__)
+    strategy.validate()
+    get_strategy_registry()[strategy.name] = strategy
+    
+    return strategy
+
+
+def get_strategy_registry():
+    '''
+    Return the shared registry of strategies by name, creating it with the 
+    built-in strategies on first use.
+    '''
+    global strategy_registry
+    if strategy_registry is None:
+        sar_stoch = make_sar_stoch_strategy()
+        strategy_registry = OrderedDict([
+            ('SAR_STOCH'  , sar_stoch),
+            ('SAR_TREND'  , Strategy('SAR_TREND', sar_stoch.indicators[:1], 
+                                     buy='sar < close', sell='sar > close')),
+            ('STOCH_CROSS', Strategy('STOCH_CROSS', sar_stoch.indicators[1:],
+                                     buy='(fastd > slowd) & (fastk > slowk)',
+                                     sell='(fastd < slowd) & (fastk < slowk)'))])
+    
+    return strategy_registry
+
+
+def get_strategies(strategies=None):
+    '''
+    Return a list of Strategy objects from names, strategies or None (all registered).
+    '''
+    registry = get_strategy_registry()
+    if strategies is None:
+        return list(registry.values())
+    
+    return [registry[strategy] if isinstance(strategy, str) else strategy for strategy in strategies]
+
+
+def run_strategies(high, low, close, strategies=None, tickers=None, timestamps=None, cache=None,
+                   processes=None):
+    '''
+    Generate signals of many strategies for a panel of tickers. The union of the
+    strategies' indicators is computed once per ticker, then every strategy's
+    rules are evaluated on the whole panel.
+    Parameters:
+        high          : 2D array of high prices (date x ticker)
+        low           : 2D array of low prices (date x ticker)
+        close         : 2D array of closing prices (date x ticker)
+        strategies    : List of names or Strategy objects. Default value is None (all registered)
+        tickers       : List of tickers (columns) used to cache indicators. Default value is None
+        timestamps    : 1D array of dates (rows) used to cache indicators. Default value is None
+        cache         : IndicatorCache to use. Default value is the shared cache
+        processes     : Number of worker processes, each taking a share of the tickers
+                        from shared memory. Default value is None (this process)
+    Return:
+        signals       : Dictionary of strategy name to 2D int8 array of 1 (buy), 
+                        -1 (sell) and 0 (no signal)
+    '''
+    strategies = get_strategies(strategies)
+    
+    # Split tickers across worker processes sharing one copy of the prices #
+    if processes is not None and processes > 1 and close.shape[1] > 1:
+        prices = np.stack([high, low, close]).astype(np.float64)
+        shm = shared_memory.SharedMemory(create=True, size=prices.nbytes)
+        try:
+            np.ndarray(prices.shape, dtype=np.float64, buffer=shm.buf)[:] = prices
+            initargs = (shm.name, prices.shape, np.arange(prices.shape[1]), list(range(prices.shape[2])))
+            del prices
+            bounds = np.linspace(0, close.shape[1], min(processes, close.shape[1]) + 1).astype(int)
+            with ProcessPoolExecutor(max_workers=processes, initializer=attach_shared_panel,
+                                     initargs=initargs) as executor:
+                futures = [executor.submit(run_shared_strategies, start, stop, strategies,
+                                           None if tickers is None else list(tickers[start:stop]),
+                                           timestamps)
+                           for start, stop in zip(bounds[:-1], bounds[1:])]
+                results = [future.result() for future in futures]
+        finally:
+            shm.close()
+            shm.unlink()
+        
+        return {strategy.name: np.concatenate([result[strategy.name] for result in results], axis=1)
+                for strategy in strategies}
+    
+    # Collect the union of indicators #
+    specs = OrderedDict()
+    for strategy in strategies:
+        for function, params, outputs in strategy.indicators:
+            specs.setdefault((function, tuple(sorted(params.items()))), (function, params, len(outputs)))
+    values = {key: [np.full(close.shape, np.nan) for _ in range(n_outputs)] 
+              for key, (function, params, n_outputs) in specs.items()}
+    valid = ~(np.isnan(high) | np.isnan(low) | np.isnan(close))
+    
+    # Calculate each indicator once on each ticker's valid rows #
+    for col in range(close.shape[1]):
+        rows = valid[:, col]
+        if not rows.any():
+            continue
+        prices = (high[rows, col], low[rows, col], close[rows, col])
+        ticker = None if tickers is None else tickers[col]
+        timestamp = None if timestamps is None else timestamps[rows][-1]
+        for key, (function, params, n_outputs) in specs.items():
+            outputs = compute_indicator(function, *prices, params=params, ticker=ticker, 
+                                        timestamp=timestamp, cache=cache)
+            for i in range(n_outputs):
+                values[key][i][rows, col] = outputs[i]
+    
+    # Evaluate every strategy on the whole panel #
+    signals = OrderedDict()
+    for strategy in strategies:
+        arrays = {'high': high, 'low': low, 'close': close}
+        for function, params, outputs in strategy.indicators:
+            arrays.update(zip(outputs, values[(function, tuple(sorted(params.items())))]))
+        signals[strategy.name] = strategy.get_signals(arrays)
+    
+    return signals
+
+
+def run_shared_strategies(start, stop, strategies, tickers=None, timestamps=None):
+    '''
+    Process pool task - generate signals for columns start to stop of the shared 
+    panel (see attach_shared_panel), reading the prices without copying them.
+    '''
+    return run_strategies(shared_panel['High'].values[:, start:stop], 
+                          shared_panel['Low'].values[:, start:stop],
+                          shared_panel['Close'].values[:, start:stop], strategies, tickers, timestamps)
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+       TECHNICAL ANALYSIS 
+##########          ##########  
+'''
+
+@instrument('test_strat')
+def test_strat(ticker, strategy='SAR_STOCH'):
+    ''' 
+    Trading strategy using Parabolic SAR and Stochastic Oscillator. Any other
+    registered strategy can be tested instead (see get_strategy_registry).
+    
+    Brief description of trading strategy:
+    We BUY when the (i) parabolic SAR line appears below the closing price and
+    (ii) the fast stochastic crosses above the slow stochastic. A SAR line that 
+    appears below the market price indicates an uptrend and since fast 
+    stochastics is more sensitive to price and when it crosses above the slow 
+    stochastic, it indicates the reversal in price direction from downward to 
     upward. Similarly, we SELL when the SAR line appears above closing price 
     and the fast stochastic crosses below the slow  stochastic. A SAR line that 
     appears above the market price indicates a downtrend and when the fast 
     stochastic crosses below the slow stochastic, it indicates the reversal 
     in price direction from upward to downward.
     
-    Note: Get TA-Lib from this website if it is not installed in your environment.
-    https://blog.quantinsti.com/install-ta-lib-python/
+    Note: Get TA-Lib from this website if it is not installed in your environment.
+    https://blog.quantinsti.com/install-ta-lib-python/
+    
+    Parameters:
+        ticker        : SGX stock ticker, e.g. S68.SI    
+        strategy      : Name of a registered strategy or Strategy. Default value is SAR_STOCH
+    '''
+    import matplotlib.pyplot as plt
+    
+    # Import target ticker's historical prices #
+    df = get_price_store().read(ticker, columns=['high', 'low', 'adjclose'])
+    df.columns = ['High', 'Low', 'Close']
+    df.index.name = 'Date'
+    
+    prices = [df[[column]].values for column in ['High', 'Low', 'Close']]
+    
+    # Calculate indicators and generate Trading Signal (see make_sar_stoch_strategy) #
+    strategy, = get_strategies([strategy])
+    signal = run_strategies(*prices, strategies=[strategy], tickers=[ticker], 
+                            timestamps=df.index.values)[strategy.name][:, 0]
+    df['Signal'] = np.where(signal == 0, np.nan, signal)
+    df = df.ffill()
+    
+    # Calculate Strategy Returns #
+    df['Stock_Return'] = df['Close'].pct_change()
+    df['strategy_return'] = (df['Stock_Return'] * df['Signal'].shift(1))
+    df = df.dropna()
+    ## Plot the cumulative strategy returns ##
+    (df['strategy_return']+1).cumprod().plot(figsize=(10,5), label = 'Strategy Returns')
+    plt.xlabel('Date')
+    plt.ylabel('Cumulative Strategy Returns')
+    plt.legend()
+    plt.show()
+    ## Calculate Sharpe Ratio , assuming risk-free rate is 1.35% p.a. ##
+    calendar = get_trading_calendar()
+    risk_free_rate = 0.0135/calendar.annual_sessions
+    sharpe = np.sqrt(calendar.annual_sessions)*(np.mean(df['strategy_return'])- (risk_free_rate))/ \
+             np.std(df['strategy_return'])
+    print ('Sharpe Ratio:', sharpe)
+    ## Calculate CAGR over SGX trading sessions ##
+    period_in_sessions = calendar.sessions_between(df.index[0], df.index[-1])
+    CAGR = ((df['strategy_return'].cumsum().iloc[-1]+1)**
+            (calendar.annual_sessions/period_in_sessions) - 1)*100
+    print ('CAGR:', CAGR)
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+           BACKTESTING 
+##########          ##########  
+'''
+
+def load_price_panel(tickers='all', store=None):
+    '''
+    Load historical prices of many tickers into one date-aligned panel.
+    Parameters:
+        tickers       : List of tickers or 'all'. Default value is 'all'
+        store         : PriceStore to read from. Default value is the Parquet store
+    Return:
+        panel         : Dictionary of High, Low and Close DataFrames (date x ticker)
+    '''
+    # Locate stored tickers #
+    if store is None:
+        store = get_price_store()
+    if tickers == 'all':
+        tickers = store.tickers('1d')
+    
+    # Read target columns once per ticker and align on the union of dates #
+    frames = {ticker: store.read(ticker, columns=['high', 'low', 'adjclose']) 
+              for ticker in tickers}
+    panel = pd.concat(frames, axis=1, sort=True)
+    panel = {'High' : panel.xs('high', axis=1, level=1),
+             'Low'  : panel.xs('low', axis=1, level=1),
+             'Close': panel.xs('adjclose', axis=1, level=1)}
+    
+    return panel
+
+
+def get_strat_signals(high, low, close, acceleration=0.02, maximum=0.2,
+                      fastk_period=5, fastd_period=3, slowk_period=3, slowd_period=3,
+                      tickers=None, timestamps=None, cache=None):
+    '''
+    Generate Parabolic SAR and Stochastic Oscillator signals for a panel of tickers.
+    TA-Lib works on one series at a time, so indicators are computed per column on
+    the ticker's own trading dates; the trading rule is then applied to the whole panel
+    (see run_strategies).
+    Parameters:
+        high          : 2D array of high prices (date x ticker)
+        low           : 2D array of low prices (date x ticker)
+        close         : 2D array of closing prices (date x ticker)
+        acceleration  : SAR acceleration factor. Default value is 0.02
+        maximum       : SAR maximum acceleration factor. Default value is 0.2
+        fastk_period  : Stochastic %K lookback. Default value is 5
+        fastd_period  : Fast stochastic %D period. Default value is 3
+        slowk_period  : Slow stochastic %K period. Default value is 3
+        slowd_period  : Slow stochastic %D period. Default value is 3
+        tickers       : List of tickers (columns) used to cache indicators. Default value is None
+        timestamps    : 1D array of dates (rows) used to cache indicators. Default value is None
+        cache         : IndicatorCache to use. Default value is the shared cache
+    Return:
+        signal        : 2D array of 1 (buy), -1 (sell) and NaN (no position yet)
+    '''
+    # Evaluate the strategy's rules (see make_sar_stoch_strategy) #
+    strategy = make_sar_stoch_strategy(acceleration, maximum, fastk_period, fastd_period,
+                                       slowk_period, slowd_period)
+    signal = run_strategies(high, low, close, [strategy], tickers, timestamps, cache)[strategy.name]
+    
+    # No signal is NaN so that positions can be carried forward #
+    signal = np.where(signal == 0, np.nan, signal)
+    
+    return signal
+
+
+@instrument('backtest_universe')
+def backtest_universe(tickers='all', risk_free_rate=0.0135, store=None, **strat_params):
+    '''
+    Backtest the Parabolic SAR and Stochastic Oscillator strategy (see test_strat)
+    over many tickers in a single vectorized pass. No plots are produced.
+    Parameters:
+        tickers        : List of tickers or 'all'. Default value is 'all'
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+        store          : PriceStore to read from. Default value is the Parquet store
+        strat_params   : Optional indicator parameters and cache passed to get_strat_signals
+    Return:
+        results        : DataFrame of Sharpe Ratio and CAGR (%) per ticker
+        returns        : DataFrame of daily strategy returns (date x ticker)
+    '''
+    # Load prices into one aligned panel #
+    panel = load_price_panel(tickers, store)
+    
+    return evaluate_strat(panel['High'], panel['Low'], panel['Close'], 
+                          risk_free_rate=risk_free_rate, **strat_params)
+
+
+@instrument('backtest_panel')
+def backtest_panel(panel=None, risk_free_rate=0.0135, max_bytes=256e6, keep_returns=False,
+                   **strat_params):
+    '''
+    Backtest the strategy over a compact PricePanel within a fixed memory budget.
+    Tickers are evaluated in chunks sized from the budget, so a memory-mapped 
+    panel of the whole universe never needs to be expanded at once.
+    Parameters:
+        panel          : PricePanel. Default value is PricePanel.from_store()
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+        max_bytes      : Memory budget per chunk of tickers. Default value is 256MB
+        keep_returns   : Also return the strategy returns as float32. Default value is False
+        strat_params   : Optional indicator parameters and cache passed to get_strat_signals
+    Return:
+        results        : DataFrame of Sharpe Ratio and CAGR (%) per ticker
+        returns        : DataFrame of daily strategy returns (date x ticker) or None
+    '''
+    if panel is None:
+        panel = PricePanel.from_store()
+    
+    # Evaluate chunks of tickers #
+    results, returns = [], []
+    for chunk in panel.iter_chunks(max_bytes):
+        chunk_results, chunk_returns = evaluate_strat(chunk.to_frame('high'), chunk.to_frame('low'),
+                                                      chunk.to_frame('adjclose'), 
+                                                      risk_free_rate=risk_free_rate, **strat_params)
+        results.append(chunk_results)
+        if keep_returns:
+            returns.append(chunk_returns.astype(np.float32))
+        metrics.increment('tickers', len(chunk.tickers), stage='backtest_panel')
+    results = pd.concat(results) if results else pd.DataFrame(columns=['SHARPE', 'CAGR'])
+    returns = pd.concat(returns, axis=1, sort=True) if returns else None
+    
+    return results, returns
+
+
+def evaluate_strat(high, low, close, risk_free_rate=0.0135, **strat_params):
+    '''
+    Calculate strategy returns, Sharpe Ratio and CAGR for a panel of prices.
+    Parameters:
+        high           : DataFrame of high prices (date x ticker)
+        low            : DataFrame of low prices (date x ticker)
+        close          : DataFrame of closing prices (date x ticker)
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+        strat_params   : Optional indicator parameters and cache passed to get_strat_signals
+    Return:
+        results        : DataFrame of Sharpe Ratio and CAGR (%) per ticker
+        returns        : DataFrame of daily strategy returns (date x ticker)
+    '''
+    # Generate trading signals for every ticker #
+    signal = get_strat_signals(high.values, low.values, close.values, 
+                               tickers=list(close.columns), timestamps=close.index.values,
+                               **strat_params)
+    signal = pd.DataFrame(signal, index=close.index, columns=close.columns)
+    
+    return evaluate_signals(signal, close, risk_free_rate)
+
+
+def evaluate_signals(signal, close, risk_free_rate=0.0135):
+    '''
+    Calculate strategy returns, Sharpe Ratio and CAGR of trading signals.
+    Parameters:
+        signal         : DataFrame of 1 (buy), -1 (sell) and NaN or 0 (no signal)
+        close          : DataFrame of closing prices (date x ticker)
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+    Return:
+        results        : DataFrame of Sharpe Ratio and CAGR (%) per ticker
+        returns        : DataFrame of daily strategy returns (date x ticker)
+    '''
+    # Carry positions forward until the next signal #
+    signal = signal.astype(np.float64).replace(0, np.nan).ffill()
+    
+    # Calculate Strategy Returns - missing bars carry the last price and position #
+    stock_return = close.ffill().pct_change().where(close.notnull())
+    returns = stock_return * signal.shift(1)
+    returns = returns.dropna(how='all')
+    
+    # Calculate Sharpe Ratio, assuming risk-free rate is 1.35% p.a. #
+    calendar = get_trading_calendar()
+    daily_rf = risk_free_rate/calendar.annual_sessions
+    sharpe = np.sqrt(calendar.annual_sessions)*(returns.mean() - daily_rf)/returns.std(ddof=0)
+    
+    # Calculate CAGR over SGX trading sessions #
+    first_date = pd.to_datetime(returns.apply(pd.Series.first_valid_index))
+    last_date = pd.to_datetime(returns.apply(pd.Series.last_valid_index))
+    valid = first_date.notnull() & last_date.notnull()
+    period_in_sessions = pd.Series(np.nan, index=returns.columns)
+    period_in_sessions[valid] = calendar.sessions_between(first_date[valid].values, 
+                                                          last_date[valid].values)
+    CAGR = ((returns.sum() + 1)**(calendar.annual_sessions/period_in_sessions) - 1)*100
+    
+    # Consolidate results #
+    results = pd.DataFrame({'SHARPE': sharpe, 'CAGR': CAGR})
+    results.index.name = 'TICKER'
+    
+    return results, returns
+
+
+@instrument('backtest_strategies')
+def backtest_strategies(tickers='all', strategies=None, risk_free_rate=0.0135, store=None, 
+                        processes=None, cache=None):
+    '''
+    Backtest many registered strategies over many tickers, computing the shared 
+    indicators once per ticker (see run_strategies).
+    Parameters:
+        tickers        : List of tickers or 'all'. Default value is 'all'
+        strategies     : List of names or Strategy objects. Default value is None (all registered)
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+        store          : PriceStore to read from. Default value is the Parquet store
+        processes      : Number of worker processes. Default value is None (this process)
+        cache          : IndicatorCache to use. Default value is the shared cache
+    Return:
+        results        : DataFrame of Sharpe Ratio and CAGR (%) per strategy and ticker
+        signals        : Dictionary of strategy name to DataFrame of int8 signals
+    '''
+    # Load prices into one aligned panel #
+    panel = load_price_panel(tickers, store)
+    close = panel['Close']
+    
+    # Generate signals of every strategy in one pass #
+    signals = run_strategies(panel['High'].values, panel['Low'].values, close.values, strategies,
+                             tickers=list(close.columns), timestamps=close.index.values, 
+                             cache=cache, processes=processes)
+    
+    # Evaluate each strategy #
+    results = {}
+    for name, signal in signals.items():
+        signals[name] = pd.DataFrame(signal, index=close.index, columns=close.columns)
+        results[name], returns = evaluate_signals(signals[name], close, risk_free_rate)
+    results = pd.concat(results, names=['STRATEGY'])
+    
+    return results, signals
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+           PORTFOLIO 
+##########          ##########  
+'''
+
+def get_target_weights(signals, scores, max_positions=20):
+    '''
+    Rank eligible tickers cross-sectionally and equally weight the best ones.
+    Parameters:
+        signals        : 2D array of signals (date x ticker) - positive means eligible
+        scores         : 2D array of ranking scores (date x ticker) - higher is better
+        max_positions  : Maximum number of tickers held. Default value is 20
+    Return:
+        weights        : 2D float32 array of target weights (date x ticker)
+    '''
+    # Ineligible tickers rank last #
+    eligible = (signals > 0) & ~np.isnan(scores)
+    ranked = np.where(eligible, scores, -np.inf).astype(np.float32)
+    
+    # Keep the top tickers of every row #
+    weights = np.zeros(signals.shape, dtype=np.float32)
+    n_top = min(max_positions, signals.shape[1])
+    if n_top == 0:
+        return weights
+    top = np.argpartition(-ranked, n_top - 1, axis=1)[:, :n_top]
+    rows = np.arange(signals.shape[0])[:, None]
+    weights[rows, top] = np.float32(1.0/max_positions)
+    weights[~eligible] = 0
+    
+    return weights
+
+
+def simulate_portfolio(signals, prices, scores=None, capital=1e6, max_positions=20, lot_size=100,
+                       commission=0.001, min_commission=0.0, slippage=0.0005, rebalance_every=5,
+                       chunk_size=250):
+    '''
+    Simulate a long-only portfolio over a date x ticker matrix of signals. On every 
+    rebalance date the eligible tickers (positive signal on the previous date) are
+    ranked by score, the best max_positions are equally weighted and orders are 
+    rounded down to board lots. Trades pay commission and slippage. Only tickers 
+    with a price on the date can trade. Holdings without one (suspended) are marked 
+    at their last price and keep their slot and value out of the rebalance, while 
+    holdings past their ticker's last bar (delisted) are sold at their last price on
+    the next rebalance. Signals end at a ticker's last bar. Prices, signals and 
+    scores are prepared one chunk of dates at a time, carrying the rows needed to 
+    forward-fill and shift across chunks, so memory is bounded by the chunk size.
+    Parameters:
+        signals         : DataFrame of signals (date x ticker), e.g. from get_strat_signals
+        prices          : DataFrame of closing prices aligned with signals
+        scores          : DataFrame of ranking scores. Default value is the 20-day return
+        capital         : Starting capital. Default value is 1,000,000
+        max_positions   : Maximum number of tickers held. Default value is 20
+        lot_size        : Board lot size. Default value is 100 shares (SGX)
+        commission      : Commission rate on traded value. Default value is 0.1%
+        min_commission  : Minimum commission per order. Default value is 0
+        slippage        : Slippage rate on traded value. Default value is 0.05%
+        rebalance_every : Number of dates between rebalances. Default value is 5
+        chunk_size      : Number of dates processed at a time. Default value is 250
+    Return:
+        portfolio       : DataFrame of equity, cash, exposure, turnover, costs and 
+                          number of positions per date
+    '''
+    # Initialise parameters #
+    n_dates, n_tickers = prices.shape
+    holdings = np.zeros(n_tickers, dtype=np.float32)
+    cash = np.float64(capital)
+    columns = ['EQUITY', 'CASH', 'EXPOSURE', 'TURNOVER', 'COSTS', 'POSITIONS']
+    portfolio = np.zeros((n_dates, len(columns)), dtype=np.float64)
+    cost_rate = commission + slippage
+    ## Row of each ticker's last bar, found one chunk at a time ##
+    last_bar = np.full(n_tickers, -1, dtype=np.int64)
+    for start in range(0, n_dates, chunk_size):
+        has_bar = prices.iloc[start:start+chunk_size].notna().to_numpy()
+        rows = start + len(has_bar) - 1 - np.argmax(has_bar[::-1], axis=0)
+        last_bar = np.where(has_bar.any(axis=0), rows, last_bar)
+    ## State carried across chunks - last marks, last signals and recent marks for scores ##
+    last_marks = np.full((1, n_tickers), np.nan)
+    last_signals = np.full((1, n_tickers), np.nan)
+    previous_signals = np.full((1, n_tickers), np.nan)
+    recent_marks = np.empty((0, n_tickers))
+    
+    for start in range(0, n_dates, chunk_size):
+        # Prepare one chunk of dates #
+        end = min(start + chunk_size, n_dates)
+        raw = prices.iloc[start:end].to_numpy(np.float64)
+        ## Only tickers with a bar on the date trade - stale prices only mark to market ##
+        tradeable = ~np.isnan(raw)
+        marks = pd.DataFrame(np.vstack([last_marks, raw])).ffill().to_numpy()[1:]
+        last_marks = marks[-1:]
+        listed = ~np.isnan(marks) & (np.arange(start, end)[:, None] <= last_bar)
+        ## Signals carry over missing bars but not past a ticker's last bar ##
+        chunk_signals = signals.reindex(index=prices.index[start:end], columns=prices.columns)
+        chunk_signals = pd.DataFrame(np.vstack([last_signals, chunk_signals.to_numpy(np.float64)]))
+        chunk_signals = chunk_signals.ffill().to_numpy()[1:]
+        last_signals = chunk_signals[-1:]
+        chunk_signals = np.where(listed, chunk_signals, 0)
+        ## Decisions use information up to the previous date ##
+        chunk_signals, previous_signals = np.vstack([previous_signals, chunk_signals[:-1]]), \
+                                          chunk_signals[-1:]
+        if scores is None:
+            extended = np.vstack([recent_marks, marks])
+            chunk_scores = pd.DataFrame(extended).pct_change(20, fill_method=None).shift(1)
+            chunk_scores = chunk_scores.to_numpy()[len(recent_marks):]
+            recent_marks = extended[-21:]
+        else:
+            chunk_scores = scores.reindex(index=prices.index[max(start - 1, 0):end], 
+                                          columns=prices.columns).to_numpy(np.float64)
+            chunk_scores = chunk_scores[:-1] if start else np.vstack([np.full((1, n_tickers), np.nan),
+                                                                      chunk_scores[:-1]])
+        chunk_prices = np.nan_to_num(marks.astype(np.float32))
+        chunk_signals = chunk_signals.astype(np.float32)
+        chunk_scores = chunk_scores.astype(np.float32)
+        
+        # Hold positions between rebalances #
+        rebalance_rows = [row - start for row in range(start, end) if row % rebalance_every == 0]
+        bounds = sorted(set([0] + rebalance_rows + [end - start]))
+        for i in range(len(bounds) - 1):
+            row, next_row = bounds[i], bounds[i+1]
+            price = chunk_prices[row]
+            turnover = costs = 0.0
+            ## Rebalance at this date's price ##
+            if row in rebalance_rows:
+                ### Delisted holdings are sold at their last mark, suspended ones stay frozen ###
+                sellable = tradeable[row] | ~listed[row]
+                frozen = (holdings > 0) & ~sellable
+                equity = cash + float(np.dot(holdings, price))
+                investable = equity - float(np.dot(holdings[frozen], price[frozen]))
+                weights = get_target_weights(chunk_signals[row:row+1] * tradeable[row],
+                                             chunk_scores[row:row+1],
+                                             max_positions - int(frozen.sum()))[0]
+                budget = weights * np.float32(investable * (1 - cost_rate))
+                lots = np.floor(np.divide(budget, price * lot_size, 
+                                          out=np.zeros(n_tickers, dtype=np.float32), 
+                                          where=tradeable[row] & (price > 0)))
+                target = np.where(sellable, lots * lot_size, holdings).astype(np.float32)
+                traded_value = np.abs(target - holdings) * price
+                orders = traded_value > 0
+                costs = float(np.maximum(traded_value * commission, min_commission * orders).sum() + 
+                              (traded_value * slippage).sum())
+                turnover = float(traded_value.sum())
+                cash -= float(np.dot(target - holdings, price)) + costs
+                holdings = target
+            ## Mark to market every date of the segment ##
+            values = chunk_prices[row:next_row] @ holdings
+            segment = portfolio[start + row:start + next_row]
+            segment[:, 0] = cash + values
+            segment[:, 1] = cash
+            segment[:, 2] = values
+            segment[0, 3] = turnover
+            segment[0, 4] = costs
+            segment[:, 5] = np.count_nonzero(holdings)
+    
+    portfolio = pd.DataFrame(portfolio, index=prices.index, columns=columns)
+    portfolio.index.name = 'Date'
+    
+    return portfolio
+
+
+def backtest_portfolio(tickers='all', store=None, risk_free_rate=0.0135, strat_params=None, 
+                       **portfolio_params):
+    '''
+    Simulate a portfolio trading the SAR + Stochastic signals of many tickers.
+    Parameters:
+        tickers          : List of tickers or 'all'. Default value is 'all'
+        store            : PriceStore to read from. Default value is the Parquet store
+        risk_free_rate   : Annual risk-free rate. Default value is 1.35% p.a.
+        strat_params     : Dictionary of indicator parameters for get_strat_signals
+        portfolio_params : Optional parameters passed to simulate_portfolio
+    Return:
+        portfolio        : DataFrame of daily portfolio equity (see simulate_portfolio)
+        stats            : Dictionary of total return, CAGR (%), Sharpe Ratio and 
+                           maximum drawdown
+    '''
+    # Load prices and generate signals #
+    panel = load_price_panel(tickers, store)
+    close = panel['Close']
+    signals = get_strat_signals(panel['High'].values, panel['Low'].values, close.values,
+                                tickers=list(close.columns), timestamps=close.index.values,
+                                **(strat_params or {}))
+    signals = pd.DataFrame(signals, index=close.index, columns=close.columns)
+    
+    # Simulate portfolio #
+    portfolio = simulate_portfolio(signals, close, **portfolio_params)
+    
+    # Calculate statistics #
+    calendar = get_trading_calendar()
+    annual_sessions = calendar.annual_sessions
+    equity = portfolio['EQUITY']
+    daily_return = equity.pct_change().dropna()
+    period_in_sessions = calendar.sessions_between(equity.index[0], equity.index[-1])
+    stats = {'TOTAL_RETURN': equity.iloc[-1]/equity.iloc[0] - 1,
+             'CAGR'        : ((equity.iloc[-1]/equity.iloc[0])**(annual_sessions/period_in_sessions) - 1)*100,
+             'SHARPE'      : np.sqrt(annual_sessions)*(daily_return.mean() - risk_free_rate/annual_sessions)/
+                             daily_return.std(ddof=0),
+             'MAX_DRAWDOWN': (equity/equity.cummax() - 1).min()}
     
+    return portfolio, stats
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+        PARAMETER SWEEP 
+##########          ##########  
+'''
+
+def make_param_grid(grid=None):
+    '''
+    Expand a grid of strategy parameters into every combination.
     Parameter:
-        ticker        : SGX stock ticker, e.g. S68.SI    
+        grid          : Dictionary of parameter name to list of values. Default value
+                        is a grid around the values hardcoded in test_strat
+    Return:
+        param_list    : List of dictionaries of parameters
     '''
-    # Import target ticker's historical prices #
-    filepath = [download_path + '\\' + file 
-                for file in os.listdir(download_path) 
-                if re.search(ticker, file)][0]
-    df = pd.read_csv(filepath, 
-                     usecols=['date', 'high', 'low', 'adjclose'],
-                     parse_dates=['date'])
-    df.columns = ['Date', 'High', 'Low', 'Close']
-    df.set_index('Date', inplace=True)
-    df.sort_index(ascending=True, inplace=True)
-    
-    # Calculate Parabolic SAR #
-    df['SAR']=ta.SAR((df['High'].values), (df['Low'].values), 
-                      acceleration = 0.02, maximum = 0.2)
-    
-    # Calculate Stochastic Oscillator #
-    ## Fast Stochastic Oscillator ##
-    df['fastk'], df['fastd'] = ta.STOCHF((df['High'].values), (df['Low'].values), (df['Close'].values),
-                                          fastk_period=5, fastd_period=3, fastd_matype=0)
-    ## Slow Stochastic Oscillator ##
-    df['slowk'], df['slowd'] = ta.STOCH((df['High'].values), (df['Low'].values), (df['Close'].values),
-                                        fastk_period=5, slowk_period=3, slowk_matype=0, 
-                                        slowd_period=3, slowd_matype=0)
-    
-    # Generate Trading Signal #
-    df['Signal'] = np.nan
-    ## Buy Signal ##
-    df.loc[(df['SAR']< df['Close']) & (df['fastd']>df['slowd']) & (df['fastk']>df['slowk']),'Signal'] = 1
-    ## Sell Signal ##
-    df.loc[(df['SAR']> df['Close']) & (df['fastd']<df['slowd']) & (df['fastk']<df['slowk']),'Signal'] = -1
-    df = df.fillna(method='ffill')
+    if grid is None:
+        grid = {'acceleration': [0.01, 0.02, 0.03, 0.04],
+                'maximum'     : [0.1, 0.2, 0.3],
+                'fastk_period': [5, 9, 14],
+                'slowk_period': [3, 5],
+                'slowd_period': [3, 5]}
     
-    # Calculate Strategy Returns #
-    df['Stock_Return'] = df['Close'].pct_change()
-    df['strategy_return'] = (df['Stock_Return'] * df['Signal'].shift(1))
-    df = df.dropna()
-    ## Plot the cumulative strategy returns ##
-    (df['strategy_return']+1).cumprod().plot(figsize=(10,5), label = 'Strategy Returns')
-    plt.xlabel('Date')
-    plt.ylabel('Cumulative Strategy Returns')
-    plt.legend()
-    plt.show()
-    ## Calculate Sharpe Ratio , assuming risk-free rate is 1.35% p.a. ##
-    risk_free_rate = 0.0135/252
-    sharpe = np.sqrt(252)*(np.mean(df['strategy_return'])- (risk_free_rate))/np.std(df['strategy_return'])
-    print ('Sharpe Ratio:', sharpe)
-    ## Calculate CAGR ##
-    period_in_days = (df.index[-1] - df.index[0]).days
-    CAGR = ((df['strategy_return'].cumsum()[-1]+1)**(365.0/period_in_days) - 1)*100
-    print ('CAGR:', CAGR)
+    return [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+
+def sample_params(space=None, n_samples=100, seed=0):
+    '''
+    Draw random combinations of strategy parameters.
+    Parameters:
+        space         : Dictionary of parameter name to (low, high) range. Integer
+                        bounds give integer parameters. Default value is a range around 
+                        the values hardcoded in test_strat
+        n_samples     : Number of combinations. Default value is 100
+        seed          : Random seed. Default value is 0
+    Return:
+        param_list    : List of dictionaries of parameters
+    '''
+    # Initialise parameters #
+    if space is None:
+        space = {'acceleration': (0.005, 0.05),
+                 'maximum'     : (0.1, 0.4),
+                 'fastk_period': (3, 21),
+                 'slowk_period': (2, 7),
+                 'slowd_period': (2, 7)}
+    rng = np.random.default_rng(seed)
+    
+    # Sample each parameter uniformly #
+    param_list = [{} for _ in range(n_samples)]
+    for name, (low, high) in space.items():
+        if isinstance(low, int) and isinstance(high, int):
+            values = rng.integers(low, high + 1, size=n_samples).tolist()
+        else:
+            values = np.round(rng.uniform(low, high, size=n_samples), 4).tolist()
+        for params, value in zip(param_list, values):
+            params[name] = value
+    
+    return param_list
+
+
+def attach_shared_panel(shm_name, shape, dates, tickers):
+    '''
+    Process pool initializer - map the shared price panel into this worker without
+    copying it.
+    Parameters:
+        shm_name      : Name of the shared memory block
+        shape         : Shape of the panel (3 x date x ticker)
+        dates         : 1D array of dates
+        tickers       : List of tickers
+    '''
+    global shared_panel
+    shm = shared_memory.SharedMemory(name=shm_name)
+    prices = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    shared_panel = {'shm'  : shm,
+                    'High' : pd.DataFrame(prices[0], index=dates, columns=tickers, copy=False),
+                    'Low'  : pd.DataFrame(prices[1], index=dates, columns=tickers, copy=False),
+                    'Close': pd.DataFrame(prices[2], index=dates, columns=tickers, copy=False)}
+
+
+def evaluate_params(param_list, risk_free_rate=0.0135):
+    '''
+    Process pool task - backtest a chunk of parameter combinations on the shared panel.
+    Parameters:
+        param_list     : List of dictionaries of parameters
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+    Return:
+        rows           : List of dictionaries of parameters and summary statistics
+    '''
+    rows = []
+    for params in param_list:
+        results, returns = evaluate_strat(shared_panel['High'], shared_panel['Low'], 
+                                          shared_panel['Close'], risk_free_rate=risk_free_rate,
+                                          **params)
+        results = results.replace([np.inf, -np.inf], np.nan)
+        row = dict(params)
+        row.update({'TICKERS'      : int(results['SHARPE'].notnull().sum()),
+                    'MEAN_SHARPE'  : results['SHARPE'].mean(),
+                    'MEDIAN_SHARPE': results['SHARPE'].median(),
+                    'MEAN_CAGR'    : results['CAGR'].mean(),
+                    'MEDIAN_CAGR'  : results['CAGR'].median()})
+        rows.append(row)
+    
+    return rows
+
+
+def iter_sweep(param_list, tickers='all', store=None, processes=None, chunk_size=10,
+               risk_free_rate=0.0135):
+    '''
+    Backtest parameter combinations in parallel and yield results as they complete.
+    Prices are loaded once and placed in shared memory, so tasks only carry their
+    parameters.
+    Parameters:
+        param_list     : List of dictionaries of parameters (see make_param_grid and
+                         sample_params)
+        tickers        : List of tickers or 'all'. Default value is 'all'
+        store          : PriceStore to read from. Default value is the Parquet store
+        processes      : Number of worker processes. Default value is the CPU count
+        chunk_size     : Number of combinations per task. Default value is 10
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+    Yield:
+        rows           : List of dictionaries of parameters and summary statistics
+    '''
+    # Load prices and copy them into shared memory #
+    panel = load_price_panel(tickers, store)
+    close = panel['Close']
+    prices = np.stack([panel['High'].values, panel['Low'].values, close.values]).astype(np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=prices.nbytes)
+    try:
+        np.ndarray(prices.shape, dtype=np.float64, buffer=shm.buf)[:] = prices
+        initargs = (shm.name, prices.shape, close.index.values, list(close.columns))
+        del panel, prices
+        
+        # Submit chunks of combinations to the process pool #
+        chunks = [param_list[i:i+chunk_size] for i in range(0, len(param_list), chunk_size)]
+        with ProcessPoolExecutor(max_workers=processes, initializer=attach_shared_panel,
+                                 initargs=initargs) as executor:
+            futures = [executor.submit(evaluate_params, chunk, risk_free_rate) for chunk in chunks]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def sweep_params(param_list=None, tickers='all', store=None, processes=None, chunk_size=10,
+                 risk_free_rate=0.0135, rank_by='MEDIAN_SHARPE'):
+    '''
+    Run a parameter sweep of the SAR + Stochastic strategy and rank the combinations.
+    Parameters:
+        param_list     : List of dictionaries of parameters. Default value is make_param_grid()
+        tickers        : List of tickers or 'all'. Default value is 'all'
+        store          : PriceStore to read from. Default value is the Parquet store
+        processes      : Number of worker processes. Default value is the CPU count
+        chunk_size     : Number of combinations per task. Default value is 10
+        risk_free_rate : Annual risk-free rate. Default value is 1.35% p.a.
+        rank_by        : Column to rank combinations by. Default value is MEDIAN_SHARPE
+    Return:
+        ranking        : DataFrame of combinations and statistics, best first
+    '''
+    if param_list is None:
+        param_list = make_param_grid()
+    rows = []
+    for chunk_rows in iter_sweep(param_list, tickers, store, processes, chunk_size, risk_free_rate):
+        rows += chunk_rows
+    ranking = pd.DataFrame(rows).sort_values(rank_by, ascending=False).reset_index(drop=True)
+    
+    return ranking
     
 ######################################################################################################################################
-# Initialise parameters #
-## Local download path ##
-download_path = os.environ['USERPROFILE'] + r'\Dropbox\Personal\Trading\Historical\SGX\Prices\Daily'
-## Headers ##
-headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_11_6)' + \
-           'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/61.0.3163.100 Safari/537.36'}
+''' 
+##########          ########## 
+       STREAMING SIGNALS 
+##########          ##########  
+'''
+
+class StreamingSAR(object):
+    '''
+    Parabolic SAR updated one bar at a time in O(1), following TA-Lib's TA_SAR so
+    that every output matches ta.SAR on the same bars.
+    Parameters:
+        acceleration  : SAR acceleration factor. Default value is 0.02
+        maximum       : SAR maximum acceleration factor. Default value is 0.2
+    '''
+    
+    def __init__(self, acceleration=0.02, maximum=0.2):
+        self.acceleration = min(acceleration, maximum)
+        self.maximum = maximum
+        self.bars = 0
+    
+    def update(self, high, low):
+        '''
+        Add one bar and return its SAR value (NaN for the first bar).
+        '''
+        self.bars += 1
+        # First bar only seeds the direction #
+        if self.bars == 1:
+            self.new_high, self.new_low = high, low
+            return np.nan
+        
+        # Second bar - initial direction from the minus directional movement #
+        if self.bars == 2:
+            diff_minus = self.new_low - low
+            diff_plus = high - self.new_high
+            self.is_long = not (diff_minus > 0 and diff_plus < diff_minus)
+            self.af = self.acceleration
+            if self.is_long:
+                self.ep, self.sar = high, self.new_low
+            else:
+                self.ep, self.sar = low, self.new_high
+            self.new_high, self.new_low = high, low
+        
+        # Shift bars #
+        prev_high, prev_low = self.new_high, self.new_low
+        self.new_high, self.new_low = high, low
+        
+        if self.is_long:
+            ## Switch to short ##
+            if low <= self.sar:
+                self.is_long = False
+                self.sar = max(self.ep, prev_high, high)
+                output = self.sar
+                self.af = self.acceleration
+                self.ep = low
+                self.sar = max(self.sar + self.af*(self.ep - self.sar), prev_high, high)
+            ## Stay long ##
+            else:
+                output = self.sar
+                if high > self.ep:
+                    self.ep = high
+                    self.af = min(self.af + self.acceleration, self.maximum)
+                self.sar = min(self.sar + self.af*(self.ep - self.sar), prev_low, low)
+        else:
+            ## Switch to long ##
+            if high >= self.sar:
+                self.is_long = True
+                self.sar = min(self.ep, prev_low, low)
+                output = self.sar
+                self.af = self.acceleration
+                self.ep = high
+                self.sar = min(self.sar + self.af*(self.ep - self.sar), prev_low, low)
+            ## Stay short ##
+            else:
+                output = self.sar
+                if low < self.ep:
+                    self.ep = low
+                    self.af = min(self.af + self.acceleration, self.maximum)
+                self.sar = max(self.sar + self.af*(self.ep - self.sar), prev_high, high)
+        
+        return output
+
+
+class StreamingSMA(object):
+    '''
+    Simple moving average updated one value at a time with a running total.
+    Parameter:
+        period        : Averaging period
+    '''
+    
+    def __init__(self, period):
+        self.period = period
+        self.values = deque()
+        self.total = 0.0
+    
+    def update(self, value):
+        '''
+        Add one value and return the average (NaN until the window is full).
+        '''
+        self.values.append(value)
+        self.total += value
+        if len(self.values) > self.period:
+            self.total -= self.values.popleft()
+        
+        return self.total/self.period if len(self.values) == self.period else np.nan
+
+
+class StreamingStochastic(object):
+    '''
+    Fast and slow Stochastic Oscillators (simple moving averages) updated one bar
+    at a time. Highest high and lowest low are tracked with monotonic queues, so
+    each update is O(1) amortised. Outputs are NaN during the same warm-up as
+    ta.STOCHF and ta.STOCH.
+    Parameters:
+        fastk_period  : Stochastic %K lookback. Default value is 5
+        fastd_period  : Fast stochastic %D period. Default value is 3
+        slowk_period  : Slow stochastic %K period. Default value is 3
+        slowd_period  : Slow stochastic %D period. Default value is 3
+    '''
+    
+    def __init__(self, fastk_period=5, fastd_period=3, slowk_period=3, slowd_period=3):
+        self.fastk_period = fastk_period
+        self.fast_lookback = fastk_period - 1 + fastd_period - 1
+        self.slow_lookback = fastk_period - 1 + slowk_period - 1 + slowd_period - 1
+        self.highs = deque()
+        self.lows = deque()
+        self.fastd = StreamingSMA(fastd_period)
+        self.slowk = StreamingSMA(slowk_period)
+        self.slowd = StreamingSMA(slowd_period)
+        self.bars = 0
+    
+    def update(self, high, low, close):
+        '''
+        Add one bar and return (fastk, fastd, slowk, slowd).
+        '''
+        bar = self.bars
+        self.bars += 1
+        
+        # Update monotonic queues of the lookback window #
+        while self.highs and self.highs[-1][1] <= high:
+            self.highs.pop()
+        self.highs.append((bar, high))
+        while self.lows and self.lows[-1][1] >= low:
+            self.lows.pop()
+        self.lows.append((bar, low))
+        while self.highs[0][0] <= bar - self.fastk_period:
+            self.highs.popleft()
+        while self.lows[0][0] <= bar - self.fastk_period:
+            self.lows.popleft()
+        if self.bars < self.fastk_period:
+            return (np.nan,)*4
+        
+        # Raw %K, as in TA-Lib #
+        highest, lowest = self.highs[0][1], self.lows[0][1]
+        diff = (highest - lowest)/100.0
+        fastk = (close - lowest)/diff if diff != 0 else 0.0
+        
+        # Smooth %K and %D #
+        fastd = self.fastd.update(fastk)
+        slowk = self.slowk.update(fastk)
+        slowd = self.slowd.update(slowk) if not np.isnan(slowk) else np.nan
+        if self.bars <= self.fast_lookback:
+            fastk = fastd = np.nan
+        if self.bars <= self.slow_lookback:
+            slowk = slowd = np.nan
+        
+        return fastk, fastd, slowk, slowd
+
+
+class StreamingStrat(object):
+    '''
+    Incremental state of the test_strat trading rule for one ticker.
+    Parameter:
+        strat_params  : Optional indicator parameters as in get_strat_signals
+    '''
+    
+    def __init__(self, acceleration=0.02, maximum=0.2, fastk_period=5, fastd_period=3, 
+                 slowk_period=3, slowd_period=3):
+        self.sar = StreamingSAR(acceleration, maximum)
+        self.stoch = StreamingStochastic(fastk_period, fastd_period, slowk_period, slowd_period)
+        self.signal = np.nan
+    
+    def update(self, high, low, close):
+        '''
+        Add one bar and return the signal, carried forward until the rule fires again.
+        '''
+        sar = self.sar.update(high, low)
+        fastk, fastd, slowk, slowd = self.stoch.update(high, low, close)
+        
+        ## Buy Signal ##
+        if sar < close and fastd > slowd and fastk > slowk:
+            self.signal = 1
+        ## Sell Signal ##
+        elif sar > close and fastd < slowd and fastk < slowk:
+            self.signal = -1
+        
+        return self.signal
+
+
+class StreamingEngine(object):
+    '''
+    Per-ticker streaming state for intraday bars. Each bar updates the ticker's
+    indicators and reports when its trading signal changes.
+    Parameter:
+        strat_params  : Optional indicator parameters as in get_strat_signals
+    '''
+    
+    def __init__(self, **strat_params):
+        self.strat_params = strat_params
+        self.states = {}
+    
+    def update(self, ticker, timestamp, high, low, close):
+        '''
+        Add one bar for the ticker.
+        Return:
+            change        : (ticker, timestamp, previous signal, new signal) if the
+                            signal changed, otherwise None
+        '''
+        state = self.states.get(ticker)
+        if state is None:
+            state = self.states[ticker] = StreamingStrat(**self.strat_params)
+        previous = state.signal
+        signal = state.update(high, low, close)
+        if signal != previous and not np.isnan(signal):
+            return (ticker, timestamp, previous, signal)
+        
+        return None
+
+
+def check_streaming(high, low, close, **strat_params):
+    '''
+    Compare streaming indicators with TA-Lib's batch results on the same bars.
+    Parameters:
+        high          : 1D array of high prices
+        low           : 1D array of low prices
+        close         : 1D array of closing prices
+        strat_params  : Optional indicator parameters as in get_strat_signals
+    Return:
+        max_diff      : Dictionary of maximum absolute difference per indicator
+    '''
+    import talib as ta
+    
+    # Initialise parameters #
+    params = dict(acceleration=0.02, maximum=0.2, fastk_period=5, fastd_period=3, 
+                  slowk_period=3, slowd_period=3)
+    params.update(strat_params)
+    sar = StreamingSAR(params['acceleration'], params['maximum'])
+    stoch = StreamingStochastic(params['fastk_period'], params['fastd_period'], 
+                                params['slowk_period'], params['slowd_period'])
+    
+    # Stream every bar #
+    streamed = np.array([(sar.update(h, l),) + stoch.update(h, l, c) 
+                         for h, l, c in zip(high, low, close)]).reshape(-1, 5)
+    
+    # Batch results #
+    batch = np.column_stack([ta.SAR(high, low, acceleration=params['acceleration'], 
+                                    maximum=params['maximum'])] +
+                            list(ta.STOCHF(high, low, close, fastk_period=params['fastk_period'],
+                                           fastd_period=params['fastd_period'], fastd_matype=0)) +
+                            list(ta.STOCH(high, low, close, fastk_period=params['fastk_period'],
+                                          slowk_period=params['slowk_period'], slowk_matype=0,
+                                          slowd_period=params['slowd_period'], slowd_matype=0)))
+    
+    # Warm-up bars must agree and values must match #
+    max_diff = {}
+    for i, name in enumerate(['SAR', 'fastk', 'fastd', 'slowk', 'slowd']):
+        if not np.array_equal(np.isnan(streamed[:, i]), np.isnan(batch[:, i])):
+            max_diff[name] = np.inf
+        else:
+            max_diff[name] = float(np.nanmax(np.abs(streamed[:, i] - batch[:, i]), initial=0))
+    
+    return max_diff
+
+
+def replay_bars(tickers='all', interval='1m', store=None, verify=False, **strat_params):
+    '''
+    Feed stored bars of many tickers through the StreamingEngine in timestamp order
+    and measure throughput.
+    Parameters:
+        tickers       : List of tickers or 'all'. Default value is 'all'
+        interval      : Stored interval to replay. Default value is 1 minute
+        store         : PriceStore to read from. Default value is the Parquet store
+        verify        : Check every ticker against TA-Lib first. Default value is False
+        strat_params  : Optional indicator parameters as in get_strat_signals
+    Return:
+        changes       : DataFrame of signal changes
+        stats         : Dictionary of bars, seconds and bars per second
+    '''
+    # Load stored bars and merge them in timestamp order #
+    if store is None:
+        store = get_price_store()
+    if tickers == 'all':
+        tickers = store.tickers(interval)
+    frames = []
+    for ticker in tickers:
+        df = store.read(ticker, interval, columns=['high', 'low', 'close']).dropna()
+        if verify:
+            max_diff = check_streaming(df['high'].values, df['low'].values, df['close'].values,
+                                       **strat_params)
+            if max(max_diff.values()) > 1e-8:
+                raise ValueError('Streaming indicators of %s differ from TA-Lib: %s' % 
+                                 (ticker, max_diff))
+        frames.append(df.assign(ticker=ticker))
+    bars = pd.concat(frames).sort_index(kind='stable')
+    
+    # Stream bars #
+    engine = StreamingEngine(**strat_params)
+    changes = []
+    start_time = time.time()
+    for timestamp, high, low, close, ticker in zip(bars.index, bars['high'].values, bars['low'].values,
+                                                   bars['close'].values, bars['ticker'].values):
+        change = engine.update(ticker, timestamp, high, low, close)
+        if change is not None:
+            changes.append(change)
+    seconds = time.time() - start_time
+    
+    # Consolidate results #
+    changes = pd.DataFrame(changes, columns=['TICKER', 'DATE', 'PREVIOUS', 'SIGNAL'])
+    stats = {'BARS'           : len(bars),
+             'SECONDS'        : seconds,
+             'BARS_PER_SECOND': len(bars)/seconds if seconds else np.inf}
+    
+    return changes, stats
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+          BENCHMARKS 
+##########          ##########  
+'''
+
+def make_financials_payload(n_tickers=1000, n_fields=25, seed=0):
+    '''
+    Generate a synthetic YahooQuery get_modules payload for benchmarking.
+    Parameters:
+        n_tickers     : Number of tickers. Default value is 1,000
+        n_fields      : Number of line items per statement row. Default value is 25
+        seed          : Random seed. Default value is 0
+    Return:
+        data          : Dictionary of ticker to dictionary of modules
+        target_tickers: List of tickers
+        modules       : List of YahooQuery modules
+    '''
+    # Initialise parameters #
+    rng = np.random.default_rng(seed)
+    statement_keys = {'balanceSheetHistory'              : 'balanceSheetStatements',
+                      'balanceSheetHistoryQuarterly'     : 'balanceSheetStatements',
+                      'incomeStatementHistory'           : 'incomeStatementHistory',
+                      'incomeStatementHistoryQuarterly'  : 'incomeStatementHistory',
+                      'cashflowStatementHistory'         : 'cashflowStatements',
+                      'cashflowStatementHistoryQuarterly': 'cashflowStatements'}
+    modules = list(statement_keys) + ['defaultKeyStatistics']
+    target_tickers = ['T%04d.SI' % i for i in range(n_tickers)]
+    fields = ['item%02d' % i for i in range(n_fields)]
+    
+    # Four periods per statement and one row of ratios per ticker #
+    data = {}
+    for target_ticker in target_tickers:
+        data[target_ticker] = {}
+        for module, key in statement_keys.items():
+            rows = [dict(zip(fields, rng.normal(size=n_fields)), endDate='2019-%02d-30' % (3*(i+1)))
+                    for i in range(4)]
+            data[target_ticker][module] = {key: rows, 'maxAge': 86400}
+        data[target_ticker]['defaultKeyStatistics'] = dict(zip(fields, rng.normal(size=n_fields)))
+    
+    return data, target_tickers, modules
+
+
+def build_statements_concat(data, target_tickers, modules):
+    '''
+    Convert YahooQuery modules into financial statements by growing each DataFrame
+    with one concat per ticker and module. Superseded by build_statements and kept
+    here as the baseline for benchmark_statements.
+    Parameters:
+        data             : Dictionary of ticker to dictionary of modules
+        target_tickers   : List of tickers
+        modules          : List of YahooQuery modules
+    Return:
+        bal_sheet        : Balance sheets
+        inc_statement    : Income statements
+        cf_statement     : Cash flow statements
+        fin_ratios       : Financial ratios
+    '''
+    # Initialise parameters #
+    ## Empty DataFrames ##
+    bal_sheet = pd.DataFrame([{'symbol' : np.nan, 'periodType': np.nan}], dtype=object)
+    inc_statement = pd.DataFrame([{'symbol' : np.nan, 'periodType': np.nan}], dtype=object)
+    cf_statement = pd.DataFrame([{'symbol' : np.nan, 'periodType': np.nan}], dtype=object)
+    fin_ratios = pd.DataFrame([{'symbol' : np.nan}], dtype=object)
+    
+    # Convert dictionaries into DataFrames #
+    for target_ticker in target_tickers:
+        for module in modules:
+            ## Balance Sheet ##
+            if re.search('balanceSheetHistory', module):
+                try:
+                    bal_sheet = pd.concat([bal_sheet,
+                            pd.DataFrame(data[target_ticker][module]['balanceSheetStatements'])],
+                                      axis=0)
+                except:
+                    pass
+                else:
+                    bal_sheet = get_period_type(bal_sheet, target_ticker, module)
+            ## Income Statement ##
+            elif re.search('incomeStatementHistory', module):
+                try:
+                    inc_statement = pd.concat([inc_statement,
+                                pd.DataFrame(data[target_ticker][module]['incomeStatementHistory'])],
+                                      axis=0)
+                except:
+                    pass
+                else:
+                    inc_statement = get_period_type(inc_statement, target_ticker, module)
+            ## Cash Flow Statement ##
+            elif re.search('cashflowStatementHistory', module):
+                try:
+                    cf_statement = pd.concat([cf_statement,
+                                pd.DataFrame(data[target_ticker][module]['cashflowStatements'])],
+                                      axis=0)
+                except:
+                    pass
+                else:
+                    cf_statement = get_period_type(cf_statement, target_ticker, module)
+            ## Financial Ratios ##
+            else:
+                try:
+                    fin_ratios = pd.concat([fin_ratios,
+                                pd.DataFrame([data[target_ticker][module]])],
+                                      axis=0)
+                except:
+                    pass
+                else:
+                    fin_ratios.loc[fin_ratios['symbol'].isnull(), 'symbol'] = target_ticker
+    
+    # Drop the first row #
+    bal_sheet.index = range(0, len(bal_sheet))
+    bal_sheet = bal_sheet.iloc[1:]
+    inc_statement.index = range(0, len(inc_statement))
+    inc_statement = inc_statement.iloc[1:]
+    cf_statement.index = range(0, len(cf_statement))
+    cf_statement = cf_statement.iloc[1:]
+    fin_ratios.index = range(0, len(fin_ratios))
+    fin_ratios = fin_ratios.iloc[1:]
+    
+    return bal_sheet, inc_statement, cf_statement, fin_ratios
+
+
+def benchmark_statements(n_tickers=1000, seed=0):
+    '''
+    Compare wall time and peak memory of build_statements against the concat-based
+    build_statements_concat on a synthetic payload.
+    Parameters:
+        n_tickers     : Number of tickers. Default value is 1,000
+        seed          : Random seed. Default value is 0
+    Return:
+        results       : DataFrame of seconds and peak MB per implementation
+    '''
+    # Generate payload #
+    data, target_tickers, modules = make_financials_payload(n_tickers, seed=seed)
+    
+    # Time each implementation with memory tracing #
+    results = []
+    for builder in [build_statements_concat, build_statements]:
+        gc.collect()
+        tracemalloc.start()
+        start_time = time.time()
+        statements = builder(data, target_tickers, modules)
+        seconds = time.time() - start_time
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({'IMPLEMENTATION': builder.__name__,
+                        'TICKERS'       : n_tickers,
+                        'ROWS'          : sum(len(statement) for statement in statements),
+                        'SECONDS'       : seconds,
+                        'PEAK_MB'       : peak/1e6})
+    
+    return pd.DataFrame(results)
+
+def make_ohlcv(n_tickers=10, n_days=750, start='2018-01-01', freq='B', seed=0):
+    '''
+    Generate synthetic OHLCV prices following a random walk.
+    Parameters:
+        n_tickers     : Number of tickers. Default value is 10
+        n_days        : Number of bars per ticker. Default value is 750
+        start         : First date. Default value is 2018-01-01
+        freq          : Bar frequency. Default value is business daily
+        seed          : Random seed. Default value is 0
+    Return:
+        prices        : Dictionary of ticker to DataFrame of prices indexed by date
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=n_days, freq=freq, name='date')
+    prices = {}
+    for i in range(n_tickers):
+        close = np.round(np.exp(rng.normal(0, 1) + np.cumsum(rng.normal(0, 0.02, n_days))), 3)
+        spread = rng.uniform(0, 0.02, (2, n_days))
+        prices['T%04d.SI' % i] = pd.DataFrame({
+            'open'    : np.round(close*(1 + rng.normal(0, 0.005, n_days)), 3),
+            'high'    : np.round(close*(1 + spread[0]), 3),
+            'low'     : np.round(close*(1 - spread[1]), 3),
+            'close'   : close,
+            'volume'  : rng.integers(0, 1e7, n_days),
+            'adjclose': close}, index=dates)
+    
+    return prices
+
+
+def make_chart_fixture(ticker, df):
+    '''
+    Format prices as a Yahoo Finance chart response, as requested by YahooQuery.
+    Parameters:
+        ticker        : Target ticker
+        df            : DataFrame of prices indexed by date
+    Return:
+        payload       : JSON bytes
+    '''
+    quote = {column: df[column].tolist() for column in ['open', 'high', 'low', 'close', 'volume']}
+    ## Last trade after the last bar, so YahooQuery keeps every bar ##
+    timestamps = df.index.values.astype('datetime64[s]').astype(np.int64).tolist()
+    result = {'meta'      : {'symbol'              : ticker, 
+                             'exchangeName'        : 'SES',
+                             'exchangeTimezoneName': 'Asia/Singapore',
+                             'gmtoffset'           : 28800,
+                             'regularMarketTime'   : timestamps[-1] + 8*3600 if timestamps else None},
+              'timestamp' : timestamps,
+              'indicators': {'quote': [quote], 'adjclose': [{'adjclose': df['adjclose'].tolist()}]}}
+    
+    return json.dumps({'chart': {'result': [result], 'error': None}}).encode()
+
+
+def serve_fixtures(fixtures):
+    '''
+    Serve recorded responses from a local HTTP server in a background thread.
+    Parameter:
+        fixtures      : Dictionary of URL path to response bytes
+    Return:
+        server        : Running HTTP server - call server.shutdown() when done
+        base_url      : URL of the server
+    '''
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = fixtures.get(self.path.split('?')[0])
+            self.send_response(200 if body is not None else 404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body or b'')))
+            self.end_headers()
+            self.wfile.write(body or b'')
+        
+        def log_message(self, *args):
+            pass
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    return server, 'http://%s:%d' % server.server_address
+
+
+def run_benchmarks(sizes=(10, 100, 1000), n_days=750, output=None, fixture_path=None, seed=0):
+    '''
+    Time the data and backtest pipeline offline on synthetic prices. YahooQuery and
+    World Trading Data requests are sent to a local stub server (see set_api_urls) 
+    and files are written to a temporary data folder, so no network access is needed.
+    Scenarios per universe size:
+        get_tickers           : WTD ticker list request, parsed and written
+        get_historical        : Chart requests through YahooQuery, parsed and written to 
+                                a ParquetStore by the streaming pipeline
+        get_historical.<stage>: Busy seconds of the pipeline's fetch, parse and write stages
+        get_financials        : quoteSummary requests through YahooQuery, build_statements 
+                                and save_financials
+        get_financials_cached : get_financials again, served from the response cache
+        store_parquet         : Write prices to a ParquetStore
+        store_csv             : Write prices to a CSVStore
+        load                  : load_price_panel from the ParquetStore
+        indicators            : get_strat_signals on the panel (no cache)
+        backtest              : evaluate_strat on the panel
+        portfolio             : simulate_portfolio on the panel
+        test_strat            : test_strat on up to 10 tickers, plotting without a display
+    Parameters:
+        sizes         : Universe sizes. Default value is 10, 100 and 1,000 tickers
+        n_days        : Number of bars per ticker. Default value is 750
+        output        : JSON file to write results to. Default value is None
+        fixture_path  : Folder of recorded <TICKER>.json chart responses to serve
+                        instead of synthetic ones. Default value is None
+        seed          : Random seed. Default value is 0
+    Return:
+        report        : Dictionary of environment details and timings per scenario
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    
+    # Initialise parameters #
+    timings = []
+    def record(scenario, n_tickers, start_time, rows=None):
+        timings.append({'scenario': scenario, 'tickers': n_tickers, 
+                        'seconds' : time.time() - start_time, 'rows': rows})
+    saved_path, saved_urls = data_path, dict(api_urls)
+    
+    for n_tickers in sizes:
+        # Prepare chart, quoteSummary, crumb and ticker list responses #
+        prices = make_ohlcv(n_tickers, n_days, seed=seed)
+        charts = {ticker: make_chart_fixture(ticker, df) for ticker, df in prices.items()}
+        if fixture_path is not None:
+            for file in os.listdir(fixture_path):
+                with open(os.path.join(fixture_path, file), 'rb') as f:
+                    charts[file[:-len('.json')]] = f.read()
+        data, target_tickers, modules = make_financials_payload(n_tickers, seed=seed)
+        fixtures = {'/v8/finance/chart/%s' % ticker: chart for ticker, chart in charts.items()}
+        fixtures.update({'/v10/finance/quoteSummary/%s' % ticker: 
+                         json.dumps({'quoteSummary': {'result': [data[ticker]], 'error': None}}).encode()
+                         for ticker in target_tickers})
+        fixtures['/v1/test/getcrumb'] = b'benchmark'
+        fixtures['/api/v1/ticker_list'] = json.dumps(
+            [{'symbol': ticker, 'name': 'Company %s' % ticker, 'currency': 'SGD'} 
+             for ticker in charts]).encode()
+        del prices, charts, data
+        server, base_url = serve_fixtures(fixtures)
+        
+        # Point the data folder and API hosts at the benchmark #
+        temp_path = tempfile.mkdtemp()
+        set_data_path(temp_path)
+        set_api_urls(base_url, base_url)
+        pd.DataFrame({'APPLICATION': ['WorldTradingData_1'], 'KEY': ['benchmark']}).to_parquet(
+            os.path.join(temp_path, 'API_TOKENS.parquet'), index=False)
+        
+        try:
+            # Tickers #
+            start_time = time.time()
+            tickers = get_tickers()
+            record('get_tickers', n_tickers, start_time, len(tickers))
+            
+            # Prices - download, parse and write overlap in the pipeline #
+            store = get_price_store('parquet')
+            start_time = time.time()
+            batch_timings, throughput = get_historical(store=store, max_workers=8)
+            ## Pipeline records are ticker batches - every stage carries the stored bars ##
+            bars = sum(store.index['1d'][ticker]['rows'] for ticker in store.tickers())
+            record('get_historical', n_tickers, start_time, bars)
+            for stage, stat in throughput.iterrows():
+                timings.append({'scenario': 'get_historical.' + stage, 'tickers': n_tickers,
+                                'seconds' : stat['BUSY_SECONDS'], 'rows': bars})
+            
+            # Financials - requested, then served from the response cache #
+            for scenario in ['get_financials', 'get_financials_cached']:
+                start_time = time.time()
+                statements = get_financials(max_workers=8)[1:]
+                record(scenario, n_tickers, start_time, sum(len(fs) for fs in statements))
+                del statements
+            
+            # Store #
+            parsed = {ticker: store.read(ticker) for ticker in store.tickers()}
+            for store_format in ['parquet', 'csv']:
+                target_store = get_price_store(store_format, os.path.join(temp_path, store_format))
+                start_time = time.time()
+                for ticker, df in parsed.items():
+                    target_store.write(ticker, df, '1d', 'Company')
+                target_store.save_index()
+                record('store_' + store_format, n_tickers, start_time)
+            
+            # Load #
+            start_time = time.time()
+            panel = load_price_panel('all', store)
+            record('load', n_tickers, start_time, panel['Close'].size)
+            
+            # Indicators #
+            high, low, close = panel['High'], panel['Low'], panel['Close']
+            start_time = time.time()
+            signals = get_strat_signals(high.values, low.values, close.values)
+            record('indicators', n_tickers, start_time, close.size)
+            
+            # Backtest #
+            start_time = time.time()
+            evaluate_strat(high, low, close, cache=IndicatorCache(max_bytes=0))
+            record('backtest', n_tickers, start_time, close.size)
+            
+            # Portfolio #
+            start_time = time.time()
+            simulate_portfolio(pd.DataFrame(signals, index=close.index, columns=close.columns), close)
+            record('portfolio', n_tickers, start_time, close.size)
+            
+            # Single-ticker test, discarding its printed statistics #
+            sample = list(parsed)[:10]
+            start_time = time.time()
+            with redirect_stdout(io.StringIO()):
+                for ticker in sample:
+                    test_strat(ticker)
+                    plt.close('all')
+            record('test_strat', len(sample), start_time, sum(len(parsed[ticker]) for ticker in sample))
+        finally:
+            server.shutdown()
+            get_response_cache().connection.close()
+            set_data_path(saved_path)
+            set_api_urls(saved_urls['yahoo'], saved_urls['wtd'])
+            shutil.rmtree(temp_path, ignore_errors=True)
+    
+    # Consolidate report #
+    report = {'created'   : dt.datetime.now().isoformat(),
+              'python'    : platform.python_version(),
+              'pandas'    : pd.__version__,
+              'numpy'     : np.__version__,
+              'n_days'    : n_days,
+              'benchmarks': timings}
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+    
+    return report
+
+    
+    
+######################################################################################################################################
+''' 
+##########          ########## 
+         COMMAND LINE 
+##########          ##########  
+'''
+
+def main(argv=None):
+    '''
+    Command line entry point, e.g. python TA_SGX.py fetch-prices --incremental
+    Parameter:
+        argv          : List of arguments. Default value is None (sys.argv)
+    '''
+    # Initialise parser #
+    parser = argparse.ArgumentParser(description='SGX prices, financials and technical analysis')
+    parser.add_argument('--data-path', help='Local data folder (default: $SGX_DATA_PATH)')
+    parser.add_argument('--exchange', default='SGX', help='Short name for stock exchange')
+    parser.add_argument('--log-level', default='INFO', help='Logging level of the JSON log lines')
+    parser.add_argument('--metrics-file', help='Write Prometheus text-format metrics to this file')
+    parser.add_argument('--offline', action='store_true', 
+                        help='Serve tickers and financials from the response cache only')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    ## Tickers ##
+    tickers_parser = subparsers.add_parser('fetch-tickers', help='Download exchange tickers')
+    tickers_parser.add_argument('--api-path', help="Filename containing World Trading Data's API tokens")
+    ## Prices ##
+    prices_parser = subparsers.add_parser('fetch-prices', help='Download historical prices')
+    prices_parser.add_argument('--start-year', type=int, default=2018)
+    prices_parser.add_argument('--interval', default='1d')
+    prices_parser.add_argument('--incremental', action='store_true', 
+                               help='Only download dates after the last stored date')
+    prices_parser.add_argument('--format', default='parquet', choices=['parquet', 'csv'])
+    prices_parser.add_argument('--batch-size', type=int, default=50)
+    prices_parser.add_argument('--workers', type=int, default=4)
+    prices_parser.add_argument('--parse-workers', type=int, default=2)
+    prices_parser.add_argument('--queue-size', type=int, default=2, 
+                               help='Batches waiting between download, parse and write stages')
+    ## Financials ##
+    financials_parser = subparsers.add_parser('fetch-financials', help='Download financial statements')
+    financials_parser.add_argument('--batch-size', type=int, default=50)
+    financials_parser.add_argument('--workers', type=int, default=4)
+    ## Excel export ##
+    export_parser = subparsers.add_parser('export-excel', help='Export tickers and financials to Excel')
+    export_parser.add_argument('--output', help='Folder for the workbooks (default: Historical folders)')
+    ## Backtest ##
+    backtest_parser = subparsers.add_parser('backtest', help='Backtest the SAR + Stochastic strategy')
+    backtest_parser.add_argument('tickers', nargs='*', help='Tickers to backtest (default: all)')
+    backtest_parser.add_argument('--plot', action='store_true', 
+                                 help='Plot cumulative returns of each ticker given (see test_strat)')
+    backtest_parser.add_argument('--output', help='Save results to this CSV file')
+    backtest_parser.add_argument('--strategies', nargs='+', 
+                                 help='Backtest these registered strategies in one pass')
+    backtest_parser.add_argument('--processes', type=int, help='Worker processes for --strategies')
+    backtest_parser.add_argument('--max-memory', type=float, 
+                                 help='Backtest a compact price panel within this budget (MB)')
+    backtest_parser.add_argument('--panel', help='Folder of a memory-mapped price panel, '
+                                 'built from the store if missing (with --max-memory)')
+    ## Benchmark ##
+    benchmark_parser = subparsers.add_parser('benchmark', help='Time the pipeline offline')
+    benchmark_parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    benchmark_parser.add_argument('--days', type=int, default=750)
+    benchmark_parser.add_argument('--fixtures', help='Folder of recorded chart responses')
+    benchmark_parser.add_argument('--output', default='benchmarks.json', help='JSON file for results')
+    args = parser.parse_args(argv)
+    if args.command == 'backtest' and args.plot and not args.tickers:
+        backtest_parser.error('--plot needs at least one ticker')
+    
+    # Run command #
+    logging.basicConfig(level=args.log_level.upper(), format='%(message)s')
+    if args.data_path is not None:
+        set_data_path(args.data_path)
+    if args.offline:
+        get_response_cache().offline = True
+    try:
+        run_command(args)
+    finally:
+        if args.metrics_file is not None:
+            metrics.write_prometheus(args.metrics_file)
+
 
-# Import historical prices from YahooQuery #
-get_historical(exchange='SGX', start_year=2018, interval='1d')
+def run_command(args):
+    '''
+    Run the parsed command line command (see main).
+    Parameter:
+        args          : Parsed arguments
+    '''
+    if args.command == 'fetch-tickers':
+        tickers = get_tickers(api_path=args.api_path, exchange=args.exchange)
+        print('%d tickers' % len(tickers))
+    elif args.command == 'fetch-prices':
+        timings, throughput = get_historical(exchange=args.exchange, start_year=args.start_year, 
+                                             interval=args.interval, store=get_price_store(args.format),
+                                             incremental=args.incremental, batch_size=args.batch_size,
+                                             max_workers=args.workers, parse_workers=args.parse_workers,
+                                             queue_size=args.queue_size)
+        print(timings)
+        print(throughput)
+    elif args.command == 'fetch-financials':
+        get_financials(exchange=args.exchange, batch_size=args.batch_size, max_workers=args.workers)
+    elif args.command == 'export-excel':
+        for filepath in export_excel(exchange=args.exchange, path=args.output):
+            print(filepath)
+    elif args.command == 'backtest':
+        if args.plot:
+            for ticker in args.tickers:
+                test_strat(ticker)
+        elif args.strategies is not None:
+            results, signals = backtest_strategies(args.tickers or 'all', args.strategies,
+                                                   processes=args.processes)
+        elif args.max_memory is not None:
+            if args.panel is not None and os.path.exists(os.path.join(args.panel, 'panel.json')):
+                panel = PricePanel.load(args.panel)
+                if args.tickers:
+                    panel = panel.select(args.tickers)
+            else:
+                panel = PricePanel.from_store(args.tickers or 'all', path=args.panel)
+            results, returns = backtest_panel(panel, max_bytes=args.max_memory*1e6)
+        else:
+            results, returns = backtest_universe(args.tickers or 'all')
+        if not args.plot:
+            print(results.to_string())
+            if args.output is not None:
+                results.to_csv(args.output)
+    elif args.command == 'benchmark':
+        report = run_benchmarks(sizes=args.sizes, n_days=args.days, output=args.output,
+                                fixture_path=args.fixtures)
+        print(pd.DataFrame(report['benchmarks']).to_string(index=False))
+    
+######################################################################################################################################
+# Initialise parameters #
+## Local data path - override with SGX_DATA_PATH or set_data_path ##
+set_data_path()
+## API hosts - override with set_api_urls ##
+set_api_urls()
+## Shared run metrics ##
+metrics = Metrics()
+## Shared response cache - reset by set_data_path ##
+response_cache = None
+## Shared proxy pool ##
+proxy_pool = None
+## Shared indicator cache ##
+indicator_cache = None
+## Shared SGX trading calendar ##
+trading_calendar = None
+## Shared strategy registry ##
+strategy_registry = None
+## Price panel shared with sweep workers ##
+shared_panel = None
 
-# Test Trading Strategy - this example uses SGX ticker as a test-bed #
-test_strat('S68.SI')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
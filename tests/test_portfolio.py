@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import TA_SGX
+
+
+COSTLESS = dict(capital=10000, max_positions=1, lot_size=1, commission=0, slippage=0, 
+                rebalance_every=5)
+
+
+@pytest.fixture
+def market():
+    '''
+    Two tickers at a flat price. B is preferred and held from the first rebalance,
+    A only becomes eligible later.
+    '''
+    dates = pd.bdate_range('2020-01-01', periods=12)
+    prices = pd.DataFrame({'A': 100.0, 'B': 100.0}, index=dates)
+    signals = pd.DataFrame({'A': [np.nan]*5 + [1.0]*7, 'B': 1.0}, index=dates)
+    scores = pd.DataFrame({'A': 1.0, 'B': 2.0}, index=dates)
+    return prices, signals, scores
+
+
+def test_delisted_holding_is_sold_without_leverage(market):
+    prices, signals, scores = market
+    prices.iloc[6:, 1] = np.nan
+    
+    portfolio = TA_SGX.simulate_portfolio(signals, prices, scores=scores, **COSTLESS)
+    
+    assert (portfolio['CASH'] >= 0).all()
+    assert (portfolio['EXPOSURE'] <= portfolio['EQUITY'] + 1e-6).all()
+    assert (portfolio['POSITIONS'] <= 1).all()
+    ## B is sold at its last price and A bought on the last rebalance ##
+    assert portfolio['TURNOVER'].iloc[10] == 20000
+    assert portfolio['EQUITY'].iloc[-1] == 10000
+
+
+def test_suspended_holding_keeps_its_slot(market):
+    prices, signals, scores = market
+    prices.iloc[9:11, 1] = np.nan
+    
+    portfolio = TA_SGX.simulate_portfolio(signals, prices, scores=scores, **COSTLESS)
+    
+    ## B cannot trade on the rebalance date, so A cannot be bought with its value ##
+    assert portfolio['TURNOVER'].iloc[10] == 0
+    assert (portfolio['CASH'] >= 0).all()
+    assert (portfolio['POSITIONS'] == [0]*5 + [1]*7).all()
+
+
+def test_chunks_match_single_pass():
+    data = TA_SGX.make_ohlcv(n_tickers=12, n_days=200, seed=3)
+    close = pd.DataFrame({ticker: df['close'] for ticker, df in data.items()})
+    close.iloc[:30, 2] = np.nan
+    close.iloc[150:, 5] = np.nan
+    close.iloc[80:90, 7] = np.nan
+    rng = np.random.default_rng(3)
+    signals = pd.DataFrame(rng.choice([np.nan, 1.0, -1.0], close.shape), index=close.index, 
+                           columns=close.columns)
+    
+    single = TA_SGX.simulate_portfolio(signals, close, max_positions=4, chunk_size=500)
+    chunked = TA_SGX.simulate_portfolio(signals, close, max_positions=4, chunk_size=7)
+    
+    np.testing.assert_allclose(chunked.values, single.values, rtol=1e-6)
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+import requests
+
+import TA_SGX
+
+
+TARGET_URL = 'http://prices.invalid/quote'
+
+
+def make_listing(proxies):
+    '''
+    Return an sslproxies.org style table of proxy addresses.
+    '''
+    rows = ''.join('<tr><td>%s</td><td>%s</td></tr>' % tuple(proxy.split(':')) for proxy in proxies)
+    return ('<html><body><table><tbody>%s</tbody></table></body></html>' % rows).encode()
+
+
+@pytest.fixture
+def fixtures():
+    '''
+    Serve a proxy listing and act as a working HTTP proxy for TARGET_URL. Requests
+    through a proxy carry the absolute URL as their path.
+    '''
+    fixtures = {TARGET_URL: b'{"price": 1.0}'}
+    server, base_url = TA_SGX.serve_fixtures(fixtures)
+    yield fixtures, base_url
+    server.shutdown()
+
+
+def test_request_skips_dead_proxy(fixtures):
+    fixtures, base_url = fixtures
+    working = base_url.split('//')[1]
+    fixtures['/proxies'] = make_listing(['127.0.0.1:1', working])
+    pool = TA_SGX.ProxyPool(base_url + '/proxies', max_failures=1, timeout=2)
+    
+    response = pool.request('get', TARGET_URL, max_retries=3)
+    
+    assert response.json() == {'price': 1.0}
+    assert '127.0.0.1:1' in pool.evicted
+    assert pool.stats[working]['success'] == 1
+
+
+def test_evictions_expire_with_ttl(fixtures):
+    fixtures, base_url = fixtures
+    fixtures['/proxies'] = make_listing(['127.0.0.1:1'])
+    pool = TA_SGX.ProxyPool(base_url + '/proxies', ttl=0.2, max_failures=1, timeout=1, backoff=0.05)
+    
+    with pytest.raises(requests.exceptions.RetryError):
+        pool.request('get', TARGET_URL, max_retries=2)
+    assert '127.0.0.1:1' in pool.evicted and not pool.stats
+    
+    # Proxy returns to the pool once its eviction is older than the TTL #
+    time.sleep(0.3)
+    pool.refresh()
+    assert '127.0.0.1:1' in pool.stats and not pool.evicted
+
+
+def test_empty_pool_backs_off_inside_retry_loop(fixtures, monkeypatch):
+    fixtures, base_url = fixtures
+    fixtures['/proxies'] = make_listing([])
+    scrapes, sleeps = [], []
+    get_proxy_list = TA_SGX.get_proxy_list
+    monkeypatch.setattr(TA_SGX, 'get_proxy_list', lambda url: scrapes.append(url) or get_proxy_list(url))
+    monkeypatch.setattr(TA_SGX.time, 'sleep', sleeps.append)
+    pool = TA_SGX.ProxyPool(base_url + '/proxies', backoff=60)
+    
+    with pytest.raises(requests.exceptions.RetryError):
+        pool.request('get', TARGET_URL, max_retries=4)
+    
+    # Scraped once within the backoff, with exponential waits between attempts #
+    assert len(scrapes) == 1
+    assert sleeps == [60, 120, 240]
+
+
+def test_target_error_is_returned_without_evicting_proxy(fixtures):
+    fixtures, base_url = fixtures
+    working = base_url.split('//')[1]
+    fixtures['/proxies'] = make_listing([working])
+    pool = TA_SGX.ProxyPool(base_url + '/proxies', max_failures=1, timeout=2)
+    
+    response = pool.request('get', 'http://prices.invalid/missing', max_retries=3)
+    
+    assert response.status_code == 404
+    assert working in pool.stats and not pool.evicted
@@ -0,0 +1,104 @@
+import pytest
+
+import TA_SGX
+
+
+MODULES = ['balanceSheetHistory', 'incomeStatementHistory']
+
+
+class FailingSession(object):
+    '''
+    Session that fails the test if a request is sent.
+    '''
+    def get(self, *args, **kwargs):
+        raise AssertionError('Offline cache sent a request')
+
+
+class ErrorTicker(object):
+    '''
+    yahooquery.Ticker stand-in returning an error message for every ticker.
+    '''
+    def __init__(self, symbols):
+        self.symbols = symbols
+    
+    def get_modules(self, modules):
+        return {symbol: 'No fundamentals data found' for symbol in self.symbols}
+
+
+def make_entries(symbols):
+    return [{'endpoint': 'get_modules', 'symbol': symbol, 'module': module, 
+             'payload': {'symbol': symbol, 'module': module}}
+            for symbol in symbols for module in MODULES]
+
+
+def test_preload_roundtrip(tmp_path):
+    cache = TA_SGX.ResponseCache()
+    cache.preload(make_entries(['A.SI', 'B.SI']))
+    cache.dump(str(tmp_path / 'responses.jsonl'))
+    
+    offline = TA_SGX.ResponseCache(str(tmp_path / 'responses.sqlite'), offline=True)
+    offline.preload(str(tmp_path / 'responses.jsonl'))
+    
+    entries = offline.get_many('get_modules', ['A.SI', 'B.SI', 'C.SI'], MODULES)
+    assert len(entries) == 4
+    assert entries[('B.SI', MODULES[1])]['payload'] == {'symbol': 'B.SI', 'module': MODULES[1]}
+    assert offline.nbytes == cache.nbytes > 0
+    ## Running size total is restored from disk ##
+    assert TA_SGX.ResponseCache(str(tmp_path / 'responses.sqlite')).nbytes == offline.nbytes
+
+
+def test_offline_serves_stale_entries_without_requests():
+    cache = TA_SGX.ResponseCache(ttls={'ticker_list': 0}, offline=True)
+    cache.put('ticker_list', 'SGX', '', {'data': [{'symbol': 'D05.SI'}]})
+    
+    payload, status = cache.fetch_json('http://wtd.invalid/ticker_list', 'ticker_list', 'SGX',
+                                       session=FailingSession())
+    assert (payload, status) == ({'data': [{'symbol': 'D05.SI'}]}, 'hit')
+    with pytest.raises(KeyError):
+        cache.fetch_json('http://wtd.invalid/ticker_list', 'ticker_list', 'HKEX', 
+                         session=FailingSession())
+
+
+def test_fetch_modules_offline(monkeypatch):
+    import yahooquery
+    monkeypatch.setattr(yahooquery, 'Ticker', FailingSession)
+    cache = TA_SGX.ResponseCache(offline=True)
+    cache.preload(make_entries(['A.SI']))
+    
+    assert TA_SGX.fetch_modules(['A.SI', 'B.SI'], MODULES, cache=cache) == \
+           {'A.SI': {module: {'symbol': 'A.SI', 'module': module} for module in MODULES}}
+
+
+def test_failed_refresh_keeps_fresh_modules(monkeypatch):
+    import yahooquery
+    monkeypatch.setattr(yahooquery, 'Ticker', ErrorTicker)
+    cache = TA_SGX.ResponseCache(ttls={MODULES[1]: 0})
+    cache.preload(make_entries(['A.SI']))
+    
+    assert TA_SGX.fetch_modules(['A.SI'], MODULES, cache=cache) == \
+           {'A.SI': {MODULES[0]: {'symbol': 'A.SI', 'module': MODULES[0]}}}
+
+
+def test_evicts_least_recently_used():
+    cache = TA_SGX.ResponseCache()
+    cache.preload(make_entries(['A.SI', 'B.SI']))
+    size = cache.nbytes
+    cache.max_bytes = size
+    cache.get_many('get_modules', ['A.SI'], MODULES)
+    
+    cache.put('get_modules', 'C.SI', MODULES[0], {'symbol': 'C.SI' * 100})
+    
+    assert cache.nbytes <= size
+    assert ('A.SI', MODULES[0]) in cache.get_many('get_modules', ['A.SI'], MODULES)
+    assert cache.get('get_modules', 'C.SI', MODULES[0]) is not None
+
+
+def test_error_answer_is_cached_as_empty(monkeypatch):
+    import yahooquery
+    requested = []
+    monkeypatch.setattr(yahooquery, 'Ticker', lambda symbols: requested.append(symbols) or ErrorTicker(symbols))
+    cache = TA_SGX.ResponseCache()
+    
+    assert TA_SGX.fetch_modules(['A.SI'], MODULES, cache=cache) == {'A.SI': {}}
+    assert TA_SGX.fetch_modules(['A.SI'], MODULES, cache=cache) == {'A.SI': {}}
+    assert requested == [['A.SI']]
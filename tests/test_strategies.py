@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import TA_SGX
+
+
+@pytest.fixture(scope='module')
+def panel():
+    data = TA_SGX.make_ohlcv(n_tickers=8, n_days=300, seed=2)
+    high, low, close = [np.column_stack([df[field].values for df in data.values()]) 
+                        for field in ['high', 'low', 'close']]
+    ## A ticker listed later than the others ##
+    for prices in (high, low, close):
+        prices[:40, 3] = np.nan
+    timestamps = next(iter(data.values())).index.values
+    return high, low, close, list(data), timestamps
+
+
+def test_parse_rule():
+    assert TA_SGX.parse_rule('(sar < close) & (fastk >= 20)') == \
+           [('sar', '<', 'close'), ('fastk', '>=', 20.0)]
+    assert TA_SGX.parse_rule([('close', '>', 'sar')]) == [('close', '>', 'sar')]
+
+
+@pytest.mark.parametrize('rule', ['__import__("os").system("true")', 'sar < close or True', 
+                                  'sar << close', 'np.ones(1)', [('sar', 'in', 'close')]])
+def test_parse_rule_rejects_expressions(rule):
+    with pytest.raises(ValueError):
+        TA_SGX.parse_rule(rule)
+
+
+def test_register_strategy_validates_arrays():
+    with pytest.raises(ValueError):
+        TA_SGX.register_strategy(TA_SGX.Strategy('BAD', [], buy='sar < close', sell='close < 1'))
+    with pytest.raises(TypeError):
+        TA_SGX.register_strategy('close > 1')
+
+
+def test_rules_match_numpy_expressions(panel):
+    high, low, close, tickers, timestamps = panel
+    signals = TA_SGX.run_strategies(high, low, close, ['SAR_TREND'], cache=TA_SGX.IndicatorCache())
+    
+    import talib as ta
+    sar = np.full(close.shape, np.nan)
+    for col in range(close.shape[1]):
+        rows = ~np.isnan(close[:, col])
+        sar[rows, col] = ta.SAR(high[rows, col], low[rows, col], acceleration=0.02, maximum=0.2)
+    expected = np.where(sar < close, 1, np.where(sar > close, -1, 0))
+    
+    np.testing.assert_array_equal(signals['SAR_TREND'], expected)
+
+
+def test_process_pool_matches_single_process(panel):
+    high, low, close, tickers, timestamps = panel
+    single = TA_SGX.run_strategies(high, low, close, tickers=tickers, timestamps=timestamps,
+                                   cache=TA_SGX.IndicatorCache())
+    pooled = TA_SGX.run_strategies(high, low, close, tickers=tickers, timestamps=timestamps,
+                                   processes=3)
+    
+    assert list(pooled) == list(single)
+    for name in single:
+        np.testing.assert_array_equal(pooled[name], single[name])
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import TA_SGX
+
+
+@pytest.fixture(scope='module')
+def bars():
+    df = TA_SGX.make_ohlcv(n_tickers=1, n_days=500, seed=1)
+    df = next(iter(df.values()))
+    return df['high'].values, df['low'].values, df['close'].values
+
+
+@pytest.mark.parametrize('strat_params', [
+    {},
+    {'acceleration': 0.01, 'maximum': 0.1},
+    {'fastk_period': 14, 'fastd_period': 5, 'slowk_period': 5, 'slowd_period': 4},
+    ])
+def test_streaming_matches_talib(bars, strat_params):
+    max_diff = TA_SGX.check_streaming(*bars, **strat_params)
+    
+    assert set(max_diff) == {'SAR', 'fastk', 'fastd', 'slowk', 'slowd'}
+    assert all(diff < 1e-9 for diff in max_diff.values()), max_diff
+
+
+def test_streaming_signals_match_batch_signals(bars):
+    high, low, close = bars
+    strat = TA_SGX.StreamingStrat()
+    streamed = np.array([strat.update(h, l, c) for h, l, c in zip(high, low, close)], dtype=np.float64)
+    
+    batch = TA_SGX.get_strat_signals(high[:, None], low[:, None], close[:, None])[:, 0]
+    ## Streaming signals hold the position between signals ##
+    batch = pd.Series(batch).ffill().values
+    
+    np.testing.assert_array_equal(streamed, batch)
+
+
+def test_streaming_engine_reports_signal_changes(bars):
+    high, low, close = bars
+    engine = TA_SGX.StreamingEngine()
+    changes = [engine.update('A.SI', i, h, l, c) for i, (h, l, c) in enumerate(zip(high, low, close))]
+    changes = [change for change in changes if change is not None]
+    
+    batch = TA_SGX.get_strat_signals(high[:, None], low[:, None], close[:, None])[:, 0]
+    ## Rows where the batch signal takes a new value ##
+    valid = np.flatnonzero(~np.isnan(batch))
+    expected = [i for j, i in enumerate(valid) if j == 0 or batch[i] != batch[valid[j-1]]]
+    
+    assert [timestamp for ticker, timestamp, previous, signal in changes] == expected